@@ -1,11 +1,69 @@
 import sqlite3
-from datetime import datetime
+import threading
+from datetime import datetime, timedelta
+from functools import lru_cache
 
 DB_PATH = "reservations.db"
 
+SQL_INSERT_RES = """
+    INSERT INTO reservations (
+        reservation_id, datetime, business, party_size,
+        customer_name, customer_email, contact_phone,
+        table_number, notes, status
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+SQL_SELECT_ALL = """
+    SELECT reservation_id, datetime, business, party_size,
+           customer_name, customer_email, contact_phone,
+           table_number, notes, status
+    FROM reservations
+    ORDER BY datetime DESC
+"""
+
+SQL_UPDATE_STATUS = "UPDATE reservations SET status = ? WHERE reservation_id = ?"
+
+SQL_INSIGHTS = """
+    SELECT COUNT(*),
+           COALESCE(SUM(status = 'confirmed'), 0),
+           COALESCE(SUM(status = 'cancelled'), 0),
+           (SELECT COUNT(*) FROM reservations WHERE datetime >= ? AND datetime < ?)
+    FROM reservations
+"""
+
+_conn = None
+_lock = threading.Lock()
+
+def get_connection():
+    """Return the shared long-lived connection, opening it on first use."""
+    global _conn
+    if _conn is None:
+        with _lock:
+            if _conn is None:
+                conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None, cached_statements=100)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.execute("PRAGMA temp_store=MEMORY")
+                conn.execute("PRAGMA busy_timeout=5000")
+                conn.execute("PRAGMA mmap_size=268435456")
+                conn.row_factory = sqlite3.Row
+                _conn = conn
+    return _conn
+
+def close_db():
+    """Refresh planner statistics and close the shared connection."""
+    global _conn
+    with _lock:
+        if _conn is not None:
+            _conn.execute("PRAGMA optimize")
+            _conn.close()
+            _conn = None
+
 def init_db():
     """Initialize the reservations database and ensure all columns exist."""
-    with sqlite3.connect(DB_PATH) as conn:
+    conn = get_connection()
+    with _lock:
         cur = conn.cursor()
         cur.execute("""
             CREATE TABLE IF NOT EXISTS reservations (
@@ -21,21 +79,16 @@ def init_db():
                 status TEXT
             )
         """)
-        conn.commit()
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_res_status ON reservations(status)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_res_datetime ON reservations(datetime)")
     print("✅ Database initialized and columns verified.")
 
 def add_reservation(reservation: dict):
     """Insert a new reservation into the database."""
-    with sqlite3.connect(DB_PATH) as conn:
+    conn = get_connection()
+    with _lock:
         cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO reservations (
-                reservation_id, datetime, business, party_size,
-                customer_name, customer_email, contact_phone,
-                table_number, notes, status
-            )
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
+        cur.execute(SQL_INSERT_RES, (
             reservation.get("reservation_id"),
             reservation.get("datetime"),
             reservation.get("business"),
@@ -47,73 +100,55 @@ def add_reservation(reservation: dict):
             reservation.get("notes"),
             reservation.get("status", "confirmed"),
         ))
-        conn.commit()
 
 def get_reservations():
     """Retrieve all reservations from the database."""
-    with sqlite3.connect(DB_PATH) as conn:
+    conn = get_connection()
+    with _lock:
         cur = conn.cursor()
-        cur.execute("""
-            SELECT reservation_id, datetime, business, party_size,
-                   customer_name, customer_email, contact_phone,
-                   table_number, notes, status
-            FROM reservations
-            ORDER BY datetime DESC
-        """)
+        cur.execute(SQL_SELECT_ALL)
         rows = cur.fetchall()
 
-    keys = ["reservation_id", "datetime", "business", "party_size",
-            "customer_name", "customer_email", "contact_phone",
-            "table_number", "notes", "status"]
-
-    return [dict(zip(keys, row)) for row in rows]
+    return [dict(row) for row in rows]
 
 def update_status(reservation_id: str, new_status: str) -> bool:
     """Update reservation status (cancelled, confirmed, updated)."""
-    with sqlite3.connect(DB_PATH) as conn:
+    conn = get_connection()
+    with _lock:
         cur = conn.cursor()
-        cur.execute("""
-            UPDATE reservations
-            SET status = ?
-            WHERE reservation_id = ?
-        """, (new_status, reservation_id))
-        conn.commit()
+        cur.execute(SQL_UPDATE_STATUS, (new_status, reservation_id))
         return cur.rowcount > 0
 
+@lru_cache(maxsize=64)
+def _update_sql(keys: tuple) -> str:
+    """Build the UPDATE statement for one sorted set of column names."""
+    fields = ", ".join(f"{key} = ?" for key in keys)
+    return f"UPDATE reservations SET {fields}, status = 'updated' WHERE reservation_id = ?"
+
 def update_reservation(reservation_id: str, updates: dict) -> bool:
     """Update reservation details such as datetime, party_size, table_number, etc."""
     if not updates:
         return False
 
-    fields = [f"{key} = ?" for key in updates.keys()]
-    values = list(updates.values()) + [reservation_id]
+    keys = tuple(sorted(updates))
+    values = [updates[key] for key in keys] + [reservation_id]
 
-    with sqlite3.connect(DB_PATH) as conn:
+    conn = get_connection()
+    with _lock:
         cur = conn.cursor()
-        cur.execute(f"""
-            UPDATE reservations
-            SET {', '.join(fields)}, status = 'updated'
-            WHERE reservation_id = ?
-        """, values)
-        conn.commit()
+        cur.execute(_update_sql(keys), values)
         return cur.rowcount > 0
 
 def get_insights():
     """Return quick analytics for dashboard overview cards."""
-    with sqlite3.connect(DB_PATH) as conn:
+    conn = get_connection()
+    with _lock:
         cur = conn.cursor()
-        cur.execute("SELECT COUNT(*) FROM reservations")
-        total = cur.fetchone()[0]
-
-        cur.execute("SELECT COUNT(*) FROM reservations WHERE status='confirmed'")
-        confirmed = cur.fetchone()[0]
-
-        cur.execute("SELECT COUNT(*) FROM reservations WHERE status='cancelled'")
-        cancelled = cur.fetchone()[0]
-
-        today_str = datetime.now().strftime("%Y-%m-%d")
-        cur.execute("SELECT COUNT(*) FROM reservations WHERE datetime LIKE ?", (f"{today_str}%",))
-        today_reservations = cur.fetchone()[0]
+        today = datetime.now().date()
+        start = today.strftime("%Y-%m-%d")
+        end = (today + timedelta(days=1)).strftime("%Y-%m-%d")
+        cur.execute(SQL_INSIGHTS, (start, end))
+        total, confirmed, cancelled, today_reservations = cur.fetchone()
 
     return {
         "total": total,
@@ -4,14 +4,26 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import os
-import json
+import orjson
 import re
+import asyncio
+import threading
+import hashlib
+import httpx
+from collections import Counter
+from contextlib import asynccontextmanager
+from urllib.parse import urlencode
+from xml.sax.saxutils import escape as xml_escape
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 from fastapi import FastAPI, Request, Form
 from fastapi.responses import HTMLResponse, Response, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from openai import OpenAI
+from fastapi.middleware.gzip import GZipMiddleware
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from cachetools import TTLCache
 
 # =====================================================================
 # BUSINESS CONFIGS — add new businesses here
@@ -66,7 +78,25 @@ try:
 except ZoneInfoNotFoundError:
     LOCAL_TZ = ZoneInfo("UTC")
 
-app = FastAPI(title="AI Reservation Bot", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Startup: size the Supabase thread pool, warm its connection and start the session writers.
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(
+        ThreadPoolExecutor(max_workers=SUPABASE_THREADS, thread_name_prefix="supabase")
+    )
+    if supabase:
+        loop.run_in_executor(None, warm_supabase)
+    writers = [asyncio.create_task(session_writer()) for _ in range(SESSION_WRITERS)]
+    yield
+    # Shutdown: flush pending session writes, then close the shared HTTP clients.
+    await flush_session_writes()
+    for writer in writers:
+        writer.cancel()
+    await twilio_http.aclose()
+    await openai_client.close()
+
+app = FastAPI(title="AI Reservation Bot", version="1.0.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -74,22 +104,38 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(GZipMiddleware, minimum_size=500)
 
-openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=50, keepalive_expiry=60)
+
+openai_client = AsyncOpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    http_client=DefaultAsyncHttpxClient(limits=HTTP_LIMITS, http2=True),
+)
+# Twilio media downloads (voice notes) share one keep-alive pool
+twilio_http = httpx.AsyncClient(limits=HTTP_LIMITS, timeout=30, follow_redirects=True)
+TWILIO_AUTH = (os.getenv("TWILIO_ACCOUNT_SID"), os.getenv("TWILIO_AUTH_TOKEN"))
 
 try:
     from supabase import create_client
     supabase = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_SERVICE_ROLE"))
+    supabase.postgrest  # build the PostgREST session now instead of on the first request
     print("✅ Supabase connected")
 except Exception as e:
     supabase = None
     print(f"ERROR: Supabase connection failed: {e}")
 
-try:
-    from twilio.twiml.messaging_response import MessagingResponse
-    print("✅ Twilio loaded")
-except ImportError:
-    print("WARNING: Twilio not available")
+# Supabase calls are blocking and run through asyncio.to_thread; the stock
+# default executor (min(32, cpus + 4) threads) caps concurrent DB round trips.
+SUPABASE_THREADS = int(os.getenv("SUPABASE_THREADS", "64"))
+
+def warm_supabase():
+    # One cheap round trip so the TLS/HTTP2 connection is open before the first webhook.
+    try:
+        supabase.table("reservations").select("reservation_id").limit(1).execute()
+        print("✅ Supabase connection warmed")
+    except Exception as e:
+        print(f"Supabase warm-up failed: {e}")
 
 # =====================================================================
 # DATE RESOLVER
@@ -100,47 +146,51 @@ WEEKDAY_MAP = {
     "jueves": 3, "viernes": 4, "sábado": 5, "sabado": 5, "domingo": 6
 }
 
-def resolve_dates(text: str) -> str:
-    today = datetime.now(LOCAL_TZ).date()
-    result = text
-
-    if re.search(r"\bpasado\s+ma[ñn]ana\b", result, re.IGNORECASE):
-        target = today + timedelta(days=2)
-        result = re.sub(r"\bpasado\s+ma[ñn]ana\b", target.strftime("%Y-%m-%d"), result, flags=re.IGNORECASE)
-
-    if re.search(r"\bma[ñn]ana\b", result, re.IGNORECASE):
-        target = today + timedelta(days=1)
-        result = re.sub(r"\bma[ñn]ana\b", target.strftime("%Y-%m-%d"), result, flags=re.IGNORECASE)
-
-    if re.search(r"\bhoy\b", result, re.IGNORECASE):
-        result = re.sub(r"\bhoy\b", today.strftime("%Y-%m-%d"), result, flags=re.IGNORECASE)
+RELATIVE_DATE_RE = re.compile(
+    r"\b(?:(?P<pasado>pasado\s+ma[ñn]ana)|(?P<manana>ma[ñn]ana)|(?P<hoy>hoy)|"
+    r"(?:este\s+|el\s+(?:pr[oó]ximo\s+)?|pr[oó]ximo\s+)?(?P<day>" + "|".join(WEEKDAY_MAP) + r"))\b",
+    re.IGNORECASE
+)
+PROXIMO_RE = re.compile(r"pr[oó]ximo", re.IGNORECASE)
 
-    for day_es, day_num in WEEKDAY_MAP.items():
-        pattern = rf"\b(?:este\s+|el\s+(?:pr[oó]ximo\s+)?|pr[oó]ximo\s+)?{day_es}\b"
-        match = re.search(pattern, result, re.IGNORECASE)
-        if match:
-            days_ahead = (day_num - today.weekday()) % 7
+def resolve_dates(text: str) -> str:
+    return resolve_dates_on(text, datetime.now(LOCAL_TZ).date())
+
+# Keyed on the local day too, so "mañana" rolls over at midnight instead of going stale.
+@lru_cache(maxsize=2048)
+def resolve_dates_on(text: str, today) -> str:
+    def replace(match):
+        if match.group("pasado"):
+            target = today + timedelta(days=2)
+        elif match.group("manana"):
+            target = today + timedelta(days=1)
+        elif match.group("hoy"):
+            target = today
+        else:
+            days_ahead = (WEEKDAY_MAP[match.group("day").lower()] - today.weekday()) % 7
             if days_ahead == 0:
                 days_ahead = 7
-            if re.search(r"pr[oó]ximo", match.group(), re.IGNORECASE):
+            if PROXIMO_RE.search(match.group()):
                 days_ahead += 7
             target = today + timedelta(days=days_ahead)
-            result = re.sub(pattern, target.strftime("%Y-%m-%d"), result, flags=re.IGNORECASE)
+        return target.isoformat()
 
-    return result
+    return RELATIVE_DATE_RE.sub(replace, text)
 
 # =====================================================================
 # TIME VALIDATOR
 # =====================================================================
 
+TIME_RE = re.compile(
+    r"(?:a\s+las\s+|las\s+)(\d{1,2})(?::(\d{2}))?\s*(a\.m\.|p\.m\.|am|pm)?|(\d{1,2})(?::(\d{2}))?\s*(a\.m\.|p\.m\.|am|pm)",
+    re.IGNORECASE
+)
+
 def extract_and_validate_time(text: str, config: dict) -> tuple[str | None, bool]:
     open_h = config.get("hours_open", 9)
     close_h = config.get("hours_close", 19)
 
-    match = re.search(
-        r"(?:a\s+las\s+|las\s+)(\d{1,2})(?::(\d{2}))?\s*(a\.m\.|p\.m\.|am|pm)?|(\d{1,2})(?::(\d{2}))?\s*(a\.m\.|p\.m\.|am|pm)",
-        text, re.IGNORECASE
-    )
+    match = TIME_RE.search(text)
     if not match:
         return None, True
 
@@ -167,31 +217,65 @@ def extract_and_validate_time(text: str, config: dict) -> tuple[str | None, bool
     time_str = f"{hour:02d}:{minute:02d}"
     return time_str, is_valid
 
+DIGIT_RE = re.compile(r"\d")
+# Spelled-out dates and times ("el veinte de noviembre a las tres") carry no digits but still need the model.
+DATE_WORD_RE = re.compile(
+    r"\b(?:enero|febrero|marzo|abril|mayo|junio|julio|agosto|sept?iembre|octubre|noviembre|diciembre"
+    r"|una?|dos|tres|cuatro|cinco|seis|siete|ocho|nueve|diez|once|doce|trece|catorce|quince"
+    r"|dieci\w+|veinte|veinti\w+|treinta|mediod[ií]a)\b",
+    re.IGNORECASE
+)
+ISO_DATE_RE = re.compile(r"\b\d{4}-\d{2}-\d{2}\b")
+CLOCK_24H_RE = re.compile(r"\b([01]?\d|2[0-3]):([0-5]\d)\b")
+
+def extract_local_datetime(resolved_text: str, config: dict) -> str | None:
+    # Works on text already passed through resolve_dates, so relative days are ISO dates by now.
+    # "de mañana para el viernes" or "de las 3 pm a las 5 pm" name two slots; only the model can tell which is meant.
+    dates = set(ISO_DATE_RE.findall(resolved_text))
+    if len(dates) != 1:
+        return None
+    time_spans = [m.span() for m in TIME_RE.finditer(resolved_text)]
+    clocks = [m for m in CLOCK_24H_RE.finditer(resolved_text) if not any(a <= m.start() < b for a, b in time_spans)]
+    if len(time_spans) + len(clocks) != 1:
+        return None
+    time_str, _ = extract_and_validate_time(resolved_text, config)
+    if time_str is None:
+        clock = CLOCK_24H_RE.search(resolved_text)
+        if not clock:
+            return None
+        time_str = f"{int(clock.group(1)):02d}:{clock.group(2)}"
+    return f"{dates.pop()} {time_str}"
+
 # =====================================================================
 # CONFIRMATION FORMAT ENFORCER
 # =====================================================================
 
+CONFIRM_PHRASE_RE = re.compile("confirmas|te parece bien|está bien|correcto|confirma la cita|te gustaría confirmar|gustaria confirmar")
+CONFIRM_NAME_RE = re.compile(r"nombre[:\*\s]+([A-Za-záéíóúñÁÉÍÓÚÑ\s]+?)(?:\n|\*|✂|📅|🕒|servicio|$)", re.IGNORECASE)
+CONFIRM_SERVICE_RE = re.compile(r"servicio[:\*\s]+([A-Za-záéíóúñÁÉÍÓÚÑ\s\+]+?)(?:\n|\*|📅|🕒|fecha|$)", re.IGNORECASE)
+CONFIRM_DATE_RE = re.compile(r"(\d{4}-\d{2}-\d{2})")
+CONFIRM_CLOCK_RE = re.compile(r"(\d{1,2}:\d{2}(?:\s*(?:a\.\s?m\.|p\.\s?m\.|am|pm)(?!\w))?)", re.IGNORECASE)
+CONFIRM_AMPM_RE = re.compile(r"(\d{1,2}(?::\d{2})?\s*(?:a\.m\.|p\.m\.|am|pm))", re.IGNORECASE)
+
 def extract_confirmation_data(text: str) -> dict | None:
     lower = text.lower()
-    if not any(phrase in lower for phrase in ["confirmas", "te parece bien", "está bien", "correcto", "confirma la cita", "te gustaría confirmar", "gustaria confirmar"]):
+    if not CONFIRM_PHRASE_RE.search(lower):
         return None
-    has_name = bool(re.search(r"nombre", lower))
-    has_service = bool(re.search(r"servicio", lower))
-    if not (has_name and has_service):
+    if "nombre" not in lower or "servicio" not in lower:
         return None
 
-    name_match = re.search(r"nombre[:\*\s]+([A-Za-záéíóúñÁÉÍÓÚÑ\s]+?)(?:\n|\*|✂|📅|🕒|servicio|$)", text, re.IGNORECASE)
+    name_match = CONFIRM_NAME_RE.search(text)
     name = name_match.group(1).strip().strip("*").strip() if name_match else None
 
-    service_match = re.search(r"servicio[:\*\s]+([A-Za-záéíóúñÁÉÍÓÚÑ\s\+]+?)(?:\n|\*|📅|🕒|fecha|$)", text, re.IGNORECASE)
+    service_match = CONFIRM_SERVICE_RE.search(text)
     service = service_match.group(1).strip().strip("*").strip() if service_match else None
 
-    date_match = re.search(r"(\d{4}-\d{2}-\d{2})", text)
+    date_match = CONFIRM_DATE_RE.search(text)
     date = date_match.group(1) if date_match else None
 
-    time_match = re.search(r"(\d{1,2}:\d{2})", text)
+    time_match = CONFIRM_CLOCK_RE.search(text)
     if not time_match:
-        time_match = re.search(r"(\d{1,2}(?::\d{2})?\s*(?:a\.m\.|p\.m\.|am|pm))", text, re.IGNORECASE)
+        time_match = CONFIRM_AMPM_RE.search(text)
     time = time_match.group(1).strip() if time_match else None
 
     if name and service and date and time:
@@ -208,33 +292,186 @@ def format_confirmation(data: dict) -> str:
         f"¿Confirmas esta información? 😊"
     )
 
+SUMMARY_RE = re.compile(
+    r"👤 Nombre: (?P<name>[^\n]+)\n✂️ Servicio: (?P<service>[^\n]+)\n"
+    r"📅 Fecha: (?P<date>\d{4}-\d{2}-\d{2})\n🕒 Hora: (?P<time>[^\n]+)"
+)
+SUMMARY_TIME_RE = re.compile(r"(\d{1,2})(?::(\d{2}))?\s*(a\.\s?m\.|p\.\s?m\.|am|pm)?", re.IGNORECASE)
+AFFIRMATIVE_RE = re.compile(
+    r"(?:s[ií]|confirmo|confirmado|correcto|dale|listo|perfecto|de una|ok|okay)"
+    r"(?:[\s,]+(?:s[ií]|confirmo|correcto|dale|gracias|por favor|porfa))*[\s!.,👍😊🙌]*",
+    re.IGNORECASE
+)
+
+def bookable_slot(date_str: str, time_str: str, config: dict) -> bool:
+    # The local fast paths only take future slots on the booking grid; anything else goes to the model.
+    if f"{date_str} {time_str}" <= datetime.now(LOCAL_TZ).strftime("%Y-%m-%d %H:%M"):
+        return False
+    try:
+        if datetime.fromisoformat(date_str).weekday() == 6:
+            return False
+    except ValueError:
+        # "2027-02-30" looks like a date to ISO_DATE_RE; leave it to the model.
+        return False
+    close_h = config.get("hours_close", 19)
+    grid = slot_times(config.get("hours_open", 9), close_h, config.get("slot_duration", 30))
+    return time_str in grid and time_str < f"{close_h:02d}:00"
+
+def confirm_from_summary(history: list, message: str, config: dict) -> str | None:
+    # A plain "sí"/"confirmo" right after our own summary needs no LLM round trip:
+    # the summary already holds everything the booking payload needs.
+    if not history or history[-1].get("role") != "assistant":
+        return None
+    if not AFFIRMATIVE_RE.fullmatch(message.strip()):
+        return None
+    match = SUMMARY_RE.search(history[-1].get("content", ""))
+    if not match:
+        return None
+    time_match = SUMMARY_TIME_RE.fullmatch(match.group("time").strip())
+    if not time_match:
+        return None
+    hour = int(time_match.group(1))
+    minute = int(time_match.group(2) or 0)
+    period = (time_match.group(3) or "").lower().replace(".", "").replace(" ", "")
+    if period == "pm" and hour != 12:
+        hour += 12
+    elif period == "am" and hour == 12:
+        hour = 0
+    elif not period and time_match.group(2) is None:
+        # "3:00" with no am/pm (or "de la tarde") is ambiguous; let the model read the conversation.
+        return None
+    if not bookable_slot(match.group("date"), f"{hour:02d}:{minute:02d}", config):
+        return None
+    payload = {
+        "name": match.group("name").strip(),
+        "service": match.group("service").strip(),
+        "datetime": f"{match.group('date')} {hour:02d}:{minute:02d}",
+    }
+    return "RESERVA_CONFIRMADA:" + orjson.dumps(payload).decode()
+
+# "soy" alone only counts when the name is closed off by a comma or the end of the message,
+# so "Soy Muy Feliz de escribir" is not read as a name.
+CLIENT_NAME_RE = re.compile(
+    r"\b(?i:me llamo|mi nombre es)\s+(?P<named>[A-ZÁÉÍÓÚÑ][a-záéíóúñ]+(?:\s+[A-ZÁÉÍÓÚÑ][a-záéíóúñ]+){0,3})"
+    r"|\b(?i:soy)\s+(?P<soy>[A-ZÁÉÍÓÚÑ][a-záéíóúñ]+(?:\s+[A-ZÁÉÍÓÚÑ][a-záéíóúñ]+){0,3})(?=\s*(?:,|$))"
+)
+
+def service_pattern(service: str) -> re.Pattern:
+    parts = []
+    for word in service.lower().split():
+        parts.append(r"(?:\+|y|con)" if word == "+" else re.escape(word).replace("ñ", "[ñn]"))
+    return re.compile(r"\b" + r"\s+".join(parts) + r"\b")
+
+# Longest names first so "corte + barba" wins over "corte".
+SERVICE_PATTERNS = {
+    config["business_id"]: [(service, service_pattern(service)) for service in sorted(config["services"], key=len, reverse=True)]
+    for config in BUSINESS_CONFIGS.values()
+}
+
+def match_service(lower_text: str, business_id: int) -> str | None:
+    for service, pattern in SERVICE_PATTERNS.get(business_id, []):
+        match = pattern.search(lower_text)
+        if match:
+            rest = lower_text[:match.start()] + " " + lower_text[match.end():]
+            if any(other.search(rest) for _, other in SERVICE_PATTERNS[business_id]):
+                return None
+            return service
+    return None
+
+def summary_from_message(resolved_text: str, config: dict) -> str | None:
+    # "Soy Ana Gómez, corte mañana a las 3 pm" carries every field the summary needs,
+    # so build it here; anything less explicit still goes to the model.
+    name_match = CLIENT_NAME_RE.search(resolved_text)
+    if not name_match:
+        return None
+    dt_str = extract_local_datetime(resolved_text, config)
+    if not dt_str:
+        return None
+    date_str, time_str = dt_str.split(" ")
+    if not bookable_slot(date_str, time_str, config):
+        return None
+    service = match_service(resolved_text.lower(), config["business_id"])
+    if not service:
+        return None
+    name = name_match.group("named") or name_match.group("soy")
+    return format_confirmation({"name": name, "service": service, "date": date_str, "time": fmt_slot(time_str)})
+
 # =====================================================================
 # SESSION MANAGEMENT
 # =====================================================================
 
-MEMORY_SESSIONS = {}
+SESSION_TTL = 24 * 3600
+MEMORY_SESSIONS = TTLCache(maxsize=10_000, ttl=SESSION_TTL)
+memory_sessions_lock = threading.Lock()
+
+def copy_session(session):
+    # Callers mutate the session in place, so hand out copies; the cache only changes through save_session.
+    return {**session, "history": list(session.get("history", []))}
 
 def get_session(phone):
+    # Assumes a single app process: save_session is then the only writer, so the cached copy is current.
+    with memory_sessions_lock:
+        cached = MEMORY_SESSIONS.get(phone)
+    if cached is not None:
+        return copy_session(cached)
     if supabase:
         try:
             result = supabase.table("sessions").select("data").eq("phone", phone).maybe_single().execute()
             if result and result.data and result.data.get("data"):
-                return result.data["data"]
+                session = result.data["data"]
+                with memory_sessions_lock:
+                    MEMORY_SESSIONS[phone] = copy_session(session)
+                return session
         except Exception as e:
             print(f"Session load error: {e}")
-    return MEMORY_SESSIONS.get(phone, {"history": [], "booked": False})
+    return {"history": [], "booked": False}
 
 def save_session(phone, session):
-    MEMORY_SESSIONS[phone] = session
+    snapshot = copy_session(session)
+    with memory_sessions_lock:
+        MEMORY_SESSIONS[phone] = snapshot
     if supabase:
+        # Only the newest snapshot per phone matters: a phone already queued or mid-write just has it replaced.
+        queued = phone in PENDING_SESSIONS or phone in SESSIONS_IN_FLIGHT
+        PENDING_SESSIONS[phone] = snapshot
+        if not queued:
+            SESSION_WRITES.put_nowait(phone)
+
+def store_session(phone, session):
+    try:
+        supabase.table("sessions").upsert({
+            "phone": phone,
+            "data": session,
+            "last_updated": datetime.now(LOCAL_TZ).isoformat()
+        }).execute()
+    except Exception as e:
+        print(f"Session save error: {e}")
+
+SESSION_WRITERS = int(os.getenv("SESSION_WRITERS", "4"))
+PENDING_SESSIONS = {}
+SESSIONS_IN_FLIGHT = set()
+# Holds each phone at most once, so it is bounded by the number of active conversations.
+SESSION_WRITES = asyncio.Queue()
+
+async def session_writer():
+    while True:
+        phone = await SESSION_WRITES.get()
+        session = PENDING_SESSIONS.pop(phone)
+        # One write per phone at a time keeps a conversation's upserts in order across writers.
+        SESSIONS_IN_FLIGHT.add(phone)
         try:
-            supabase.table("sessions").upsert({
-                "phone": phone,
-                "data": session,
-                "last_updated": datetime.now(LOCAL_TZ).isoformat()
-            }).execute()
-        except Exception as e:
-            print(f"Session save error: {e}")
+            await asyncio.to_thread(store_session, phone, session)
+        finally:
+            SESSIONS_IN_FLIGHT.discard(phone)
+            if phone in PENDING_SESSIONS:
+                SESSION_WRITES.put_nowait(phone)
+            SESSION_WRITES.task_done()
+
+async def flush_session_writes():
+    try:
+        await asyncio.wait_for(SESSION_WRITES.join(), timeout=10)
+    except asyncio.TimeoutError:
+        print(f"Session save error: {len(PENDING_SESSIONS) + len(SESSIONS_IN_FLIGHT)} writes dropped on shutdown")
 
 # =====================================================================
 # SAVE RESERVATION
@@ -243,18 +480,55 @@ def save_session(phone, session):
 def save_reservation(phone, business_id, extracted):
     if not supabase:
         return
+    supabase.table("reservations").insert({
+        "contact_phone": phone,
+        "business_id": business_id,
+        "client_name": extracted.get("name"),
+        "service": extracted.get("service"),
+        "datetime": extracted.get("datetime"),
+        "status": "confirmed"
+    }).execute()
+    print(f"✅ Reservation saved for {phone}")
+
+booking_rpc_available = True
+
+def rpc_missing(e: Exception) -> bool:
+    # Only a function PostgREST can't find is safe to retry another way; any other
+    # error may have hit after the RPC committed.
+    return getattr(e, "code", None) in ("PGRST202", 404, "404")
+
+def book_reservation(phone, business_id, extracted) -> bool:
+    global booking_rpc_available
+    if not supabase:
+        return True
+    if booking_rpc_available:
+        try:
+            result = supabase.rpc("book_reservation", {
+                "p_business_id": business_id,
+                "p_contact_phone": phone,
+                "p_client_name": extracted.get("name"),
+                "p_service": extracted.get("service"),
+                "p_datetime": extracted.get("datetime"),
+                "p_capacity": SLOT_CAPACITY
+            }).execute()
+            if result.data:
+                print(f"✅ Reservation saved for {phone}")
+            return bool(result.data)
+        except Exception as e:
+            if not rpc_missing(e):
+                # Callers report this as a failed booking, not as a full slot.
+                raise
+            booking_rpc_available = False
+            print(f"Booking RPC missing, falling back: {e}")
+    if not is_slot_available(extracted.get("datetime"), business_id):
+        return False
     try:
-        supabase.table("reservations").insert({
-            "contact_phone": phone,
-            "business_id": business_id,
-            "client_name": extracted.get("name"),
-            "service": extracted.get("service"),
-            "datetime": extracted.get("datetime"),
-            "status": "confirmed"
-        }).execute()
-        print(f"✅ Reservation saved for {phone}")
+        save_reservation(phone, business_id, extracted)
     except Exception as e:
-        print(f"ERROR saving reservation: {e}")
+        if getattr(e, "code", None) != "23505":
+            raise
+        print(f"Reservation already on file for {phone}")
+    return True
 
 # =====================================================================
 # OPENAI
@@ -310,12 +584,18 @@ REGLAS:
 - Cuando el cliente responda "confirmo", "sí", "correcto" o cualquier confirmación después de ver el resumen, responde ÚNICAMENTE con el JSON RESERVA_CONFIRMADA. Nada más.
 - Si el cliente dice "a las 5 pm", "a las 3", "a las 17:00" o cualquier variación, eso ES la hora. No preguntes por la hora de nuevo."""
 
-def ask_openai(config, history, new_message):
-    system_prompt = build_system_prompt(config)
-    messages = [{"role": "system", "content": system_prompt}]
+# The prompt only depends on the static business config, so each one is rendered once.
+SYSTEM_MESSAGES = {
+    config["business_id"]: {"role": "system", "content": build_system_prompt(config)}
+    for config in BUSINESS_CONFIGS.values()
+}
+
+async def ask_openai(config, history, new_message):
+    system_message = SYSTEM_MESSAGES.get(config["business_id"]) or {"role": "system", "content": build_system_prompt(config)}
+    messages = [system_message]
     messages += history
     messages.append({"role": "user", "content": new_message})
-    response = openai_client.chat.completions.create(
+    response = await openai_client.chat.completions.create(
         model="gpt-4o-mini",
         messages=messages,
         max_tokens=500,
@@ -323,17 +603,52 @@ def ask_openai(config, history, new_message):
     )
     return response.choices[0].message.content.strip()
 
+FIRST_TURN_REPLIES = TTLCache(maxsize=1024, ttl=3600)
+FIRST_TURN_INFLIGHT = {}
+WHITESPACE_RE = re.compile(r"\s+")
+
+def first_turn_key(business_id, message):
+    # "Hola", "hola!" and " HOLA " are the same opener; hash so long messages don't bloat the cache.
+    normalized = WHITESPACE_RE.sub(" ", message.casefold()).strip(" .,!¡?¿")
+    return business_id, hashlib.blake2b(normalized.encode(), digest_size=16).digest()
+
+async def ask_openai_cached(config, history, new_message):
+    # Only the opening message of a conversation is cacheable: later replies depend on history.
+    if history:
+        return await ask_openai(config, history, new_message)
+    key = first_turn_key(config["business_id"], new_message)
+    reply = FIRST_TURN_REPLIES.get(key)
+    if reply is not None:
+        return reply
+    # Identical openers arriving together ("Hola" bursts) share one OpenAI call.
+    pending = FIRST_TURN_INFLIGHT.get(key)
+    if pending is not None:
+        return await asyncio.shield(pending)
+    task = asyncio.ensure_future(ask_openai(config, history, new_message))
+    FIRST_TURN_INFLIGHT[key] = task
+    try:
+        reply = await asyncio.shield(task)
+    finally:
+        FIRST_TURN_INFLIGHT.pop(key, None)
+    if "RESERVA_CONFIRMADA:" not in reply:
+        FIRST_TURN_REPLIES[key] = reply
+    return reply
+
 # =====================================================================
 # AVAILABILITY + CANCELLATION + RESCHEDULE
 # =====================================================================
 
+SLOT_CAPACITY = 3
+# Everything the cancel/reschedule replies read from a client's booking.
+BOOKING_COLUMNS = "reservation_id,client_name,service,datetime"
+
 def is_slot_available(datetime_str: str, business_id: int) -> bool:
     if not supabase:
         return True
     try:
         result = supabase.table("reservations").select("reservation_id", count="exact").eq("business_id", business_id).eq("datetime", datetime_str).eq("status", "confirmed").execute()
         count = result.count or 0
-        return count < 3
+        return count < SLOT_CAPACITY
     except Exception as e:
         print(f"Availability check error: {e}")
         return True
@@ -342,7 +657,7 @@ def cancel_reservation(phone: str, business_id: int) -> dict:
     if not supabase:
         return {"success": False}
     try:
-        result = supabase.table("reservations").select("*").eq("contact_phone", phone).eq("business_id", business_id).eq("status", "confirmed").order("datetime", desc=True).limit(1).execute()
+        result = supabase.table("reservations").select(BOOKING_COLUMNS).eq("contact_phone", phone).eq("business_id", business_id).eq("status", "confirmed").order("datetime", desc=True).limit(1).execute()
         if not result.data:
             return {"success": False, "reason": "no_booking"}
         booking = result.data[0]
@@ -352,11 +667,34 @@ def cancel_reservation(phone: str, business_id: int) -> dict:
         print(f"Cancel error: {e}")
         return {"success": False}
 
+reschedule_rpc_available = True
+
 def reschedule_reservation(phone: str, business_id: int, new_datetime: str) -> dict:
+    global reschedule_rpc_available
     if not supabase:
         return {"success": False}
+    if reschedule_rpc_available:
+        try:
+            result = supabase.rpc("reschedule_reservation", {
+                "p_business_id": business_id,
+                "p_contact_phone": phone,
+                "p_datetime": new_datetime,
+                "p_capacity": SLOT_CAPACITY
+            }).execute()
+            data = result.data or {}
+            booking = data.get("booking")
+            if not booking:
+                return {"success": False, "reason": data.get("reason")}
+            booking["datetime"] = new_datetime
+            return {"success": True, "booking": booking}
+        except Exception as e:
+            if not rpc_missing(e):
+                print(f"Reschedule RPC error: {e}")
+                return {"success": False}
+            reschedule_rpc_available = False
+            print(f"Reschedule RPC missing, falling back: {e}")
     try:
-        result = supabase.table("reservations").select("*").eq("contact_phone", phone).eq("business_id", business_id).eq("status", "confirmed").order("datetime", desc=True).limit(1).execute()
+        result = supabase.table("reservations").select(BOOKING_COLUMNS).eq("contact_phone", phone).eq("business_id", business_id).eq("status", "confirmed").order("datetime", desc=True).limit(1).execute()
         if not result.data:
             return {"success": False, "reason": "no_booking"}
         booking = result.data[0]
@@ -369,43 +707,61 @@ def reschedule_reservation(phone: str, business_id: int, new_datetime: str) -> d
         print(f"Reschedule error: {e}")
         return {"success": False}
 
+def get_booked_slot_counts(business_id: int, start_date: str, end_date: str) -> Counter:
+    if not supabase:
+        return Counter()
+    try:
+        result = supabase.table("reservations").select("datetime").eq("business_id", business_id).eq("status", "confirmed").gte("datetime", start_date).lt("datetime", end_date).execute()
+        return Counter((r.get("datetime") or "")[:16].replace("T", " ") for r in result.data or [])
+    except Exception as e:
+        print(f"Availability check error: {e}")
+        return Counter()
+
+@lru_cache(maxsize=32)
+def slot_times(open_h: int, close_h: int, slot_duration: int) -> tuple[str, ...]:
+    # The same "HH:MM" grid applies to every open day, so build it once per schedule.
+    times = []
+    current_hour = open_h
+    current_min = 0
+    while True:
+        slot_end_min = current_min + slot_duration
+        end_hour = current_hour + slot_end_min // 60
+        if end_hour > close_h:
+            break
+        times.append(f"{current_hour:02d}:{current_min:02d}")
+        current_min += slot_duration
+        if current_min >= 60:
+            current_hour += 1
+            current_min = current_min % 60
+    return tuple(times)
+
 def get_available_slots(business_id: int, config: dict, days_ahead: int = 7) -> list:
     today = datetime.now(LOCAL_TZ).date()
     open_h = config.get("hours_open", 9)
     close_h = config.get("hours_close", 19)
     slot_duration = config.get("slot_duration", 30)
+    times = slot_times(open_h, close_h, slot_duration)
     available = []
+    booked = get_booked_slot_counts(
+        business_id,
+        (today + timedelta(days=1)).isoformat(),
+        (today + timedelta(days=days_ahead + 1)).isoformat(),
+    )
 
     for i in range(1, days_ahead + 1):
         check_date = today + timedelta(days=i)
         if check_date.weekday() == 6:
             continue
-        slots_for_day = []
-        current_hour = open_h
-        current_min = 0
-        while True:
-            slot_end_min = current_min + slot_duration
-            end_hour = current_hour + slot_end_min // 60
-            if end_hour > close_h:
-                break
-            dt_str = f"{check_date.strftime('%Y-%m-%d')} {current_hour:02d}:{current_min:02d}"
-            if is_slot_available(dt_str, business_id):
-                slots_for_day.append(f"{current_hour:02d}:{current_min:02d}")
-            current_min += slot_duration
-            if current_min >= 60:
-                current_hour += 1
-                current_min = current_min % 60
+        day_str = check_date.isoformat()
+        slots_for_day = [t for t in times if booked[f"{day_str} {t}"] < SLOT_CAPACITY]
         if slots_for_day:
             available.append({"date": check_date, "slots": slots_for_day})
 
     return available
 
-def transcribe_audio(media_url: str) -> str | None:
+async def transcribe_audio(media_url: str) -> str | None:
     try:
-        import httpx
-        account_sid = os.getenv("TWILIO_ACCOUNT_SID")
-        auth_token = os.getenv("TWILIO_AUTH_TOKEN")
-        response = httpx.get(media_url, auth=(account_sid, auth_token), timeout=30, follow_redirects=True)
+        response = await twilio_http.get(media_url, auth=TWILIO_AUTH)
         if response.status_code != 200:
             print(f"Failed to download audio: {response.status_code}")
             return None
@@ -416,7 +772,7 @@ def transcribe_audio(media_url: str) -> str | None:
         import io
         audio_file = io.BytesIO(audio_bytes)
         audio_file.name = "audio.ogg"
-        transcript = openai_client.audio.transcriptions.create(
+        transcript = await openai_client.audio.transcriptions.create(
             model="whisper-1",
             file=audio_file,
             language="es"
@@ -445,53 +801,102 @@ async def verify_webhook(request: Request):
 # WEBHOOK
 # =====================================================================
 
+CANCEL_KEYWORDS = ["cancelar", "cancela", "cancel", "quiero cancelar", "cancelar cita"]
+RESCHEDULE_KEYWORDS = ["cambiar", "reschedule", "reprogramar", "cambiar cita", "mover cita", "otra fecha", "otro horario"]
+AVAILABILITY_KEYWORDS = [r"\bdisponibilidad\b", r"cuando tienen", r"cuándo tienen", r"qué días", r"que dias", r"horarios disponibles", r"cuando puedo", r"cuándo puedo"]
+
+CANCEL_RE = re.compile("|".join(map(re.escape, CANCEL_KEYWORDS)))
+RESCHEDULE_RE = re.compile("|".join(map(re.escape, RESCHEDULE_KEYWORDS)))
+AVAILABILITY_RE = re.compile("|".join(AVAILABILITY_KEYWORDS))
+
+PROCESSED_MESSAGES = TTLCache(maxsize=4096, ttl=600)
+
+# Same bytes twilio's MessagingResponse produces, without building an ElementTree per reply.
+TWIML_MESSAGE = '<?xml version="1.0" encoding="UTF-8"?><Response><Message>{}</Message></Response>'
+EMPTY_TWIML = '<?xml version="1.0" encoding="UTF-8"?><Response />'
+
+def twiml_message(text: str) -> str:
+    return TWIML_MESSAGE.format(xml_escape(text))
+
+VOICE_NOTE_FAILED_TWIML = twiml_message("No pude escuchar tu mensaje de voz. ¿Puedes escribirlo?")
+UNCONFIGURED_NUMBER_TWIML = twiml_message("Este número no está configurado.")
+TEXT_ONLY_TWIML = twiml_message("Por ahora solo puedo leer mensajes de texto o notas de voz 😊 ¿En qué te puedo ayudar?")
+
+PREFERRED_SLOTS = frozenset(["09:00", "10:00", "11:00", "13:00", "14:00", "15:00", "16:00", "17:00"])
+
+def fmt_slot(s):
+    # Slots are always zero-padded "HH:MM" from get_available_slots.
+    h, m = int(s[:2]), int(s[3:5])
+    period = "AM" if h < 12 else "PM"
+    h12 = h if h <= 12 else h - 12
+    if h12 == 0: h12 = 12
+    return f"{h12}:{str(m).zfill(2)} {period}"
+
 @app.post("/webhook")
 async def webhook(request: Request):
     form = await request.form()
+
+    # Twilio redelivers a message when our reply is slow; replay the first answer instead of booking twice.
+    message_sid = form.get("MessageSid", "")
+    if not message_sid:
+        return Response(content=await handle_message(form), media_type="application/xml")
+    if message_sid in PROCESSED_MESSAGES:
+        print(f"🔁 Duplicate delivery of {message_sid} ignored")
+        return Response(content=PROCESSED_MESSAGES[message_sid] or EMPTY_TWIML, media_type="application/xml")
+    PROCESSED_MESSAGES[message_sid] = None
+    try:
+        twiml = await handle_message(form)
+    except Exception:
+        # Let Twilio's retry run the message again instead of replaying an empty reply.
+        PROCESSED_MESSAGES.pop(message_sid, None)
+        raise
+    PROCESSED_MESSAGES[message_sid] = twiml
+    return Response(content=twiml, media_type="application/xml")
+
+async def handle_message(form) -> str:
     incoming_msg = form.get("Body", "").strip()
     media_url = form.get("MediaUrl0", "")
     media_type = form.get("MediaContentType0", "")
 
+    from_number = form.get("From", "").replace("whatsapp:", "")
+    to_number = form.get("To", "").replace("whatsapp:", "")
+
     if media_url and "audio" in media_type:
-        transcribed = transcribe_audio(media_url)
+        transcribed, session = await asyncio.gather(
+            transcribe_audio(media_url),
+            asyncio.to_thread(get_session, from_number),
+        )
         if transcribed:
             incoming_msg = transcribed
         else:
-            resp = MessagingResponse()
-            resp.message("No pude escuchar tu mensaje de voz. ¿Puedes escribirlo?")
-            return Response(content=str(resp), media_type="application/xml")
-
-    from_number = form.get("From", "").replace("whatsapp:", "")
-    to_number = form.get("To", "").replace("whatsapp:", "")
+            return VOICE_NOTE_FAILED_TWIML
+    else:
+        session = None
 
     print(f"📩 Message from {from_number} to {to_number}: {incoming_msg}")
 
     config = BUSINESS_CONFIGS.get(to_number)
     if not config:
-        resp = MessagingResponse()
-        resp.message("Este número no está configurado.")
-        return Response(content=str(resp), media_type="application/xml")
+        return UNCONFIGURED_NUMBER_TWIML
+
+    if not incoming_msg:
+        # Stickers, photos, locations: nothing for the model to read.
+        return TEXT_ONLY_TWIML
 
-    session = get_session(from_number)
+    if session is None:
+        session = await asyncio.to_thread(get_session, from_number)
     history = session.get("history", [])
 
-    resolved_msg = resolve_dates(incoming_msg)
-    if resolved_msg != incoming_msg:
-        print(f"📅 Date resolved: '{incoming_msg}' → '{resolved_msg}'")
-        resolved_msg = resolved_msg + f" [FECHA RESUELTA POR SISTEMA: usa exactamente esta fecha en el resumen]"
-
-    cancel_keywords = ["cancelar", "cancela", "cancel", "quiero cancelar", "cancelar cita"]
-    reschedule_keywords = ["cambiar", "reschedule", "reprogramar", "cambiar cita", "mover cita", "otra fecha", "otro horario"]
-    availability_keywords = [r"\bdisponibilidad\b", r"cuando tienen", r"cuándo tienen", r"qué días", r"que dias", r"horarios disponibles", r"cuando puedo", r"cuándo puedo"]
-    def fmt_slot(s):
-        h, m = map(int, s.split(":"))
-        period = "AM" if h < 12 else "PM"
-        h12 = h if h <= 12 else h - 12
-        if h12 == 0: h12 = 12
-        return f"{h12}:{str(m).zfill(2)} {period}"
-
-    if any(re.search(kw, incoming_msg.lower()) for kw in availability_keywords):
-        slots = get_available_slots(config["business_id"], config)
+    resolved_text = resolve_dates(incoming_msg)
+    resolved_msg = resolved_text
+    if resolved_text != incoming_msg:
+        print(f"📅 Date resolved: '{incoming_msg}' → '{resolved_text}'")
+        resolved_msg = resolved_text + f" [FECHA RESUELTA POR SISTEMA: usa exactamente esta fecha en el resumen]"
+
+    lower_msg = incoming_msg.lower()
+
+    if AVAILABILITY_RE.search(lower_msg):
+        slots = await asyncio.to_thread(get_available_slots, config["business_id"], config)
         if not slots:
             reply = "Lo siento, no hay disponibilidad en los próximos 7 días. Contáctanos directamente."
         else:
@@ -500,14 +905,14 @@ async def webhook(request: Request):
                 date_obj = day["date"]
                 dia = DIAS_ES[date_obj.weekday()]
                 mes = MESES_ES[date_obj.month - 1]
-                preferred = [s for s in day["slots"] if s in ["09:00", "10:00", "11:00", "13:00", "14:00", "15:00", "16:00", "17:00"]]
+                preferred = [s for s in day["slots"] if s in PREFERRED_SLOTS]
                 slot_list = " · ".join(fmt_slot(s) for s in (preferred if preferred else day["slots"][:6]))
                 lines.append(f"{dia} {date_obj.day} {mes} → {slot_list}")
             lines.append("\n¿Cuál te queda mejor? 😊")
             reply = "\n".join(lines)
 
-    elif any(kw in incoming_msg.lower() for kw in cancel_keywords):
-        result = cancel_reservation(from_number, config["business_id"])
+    elif CANCEL_RE.search(lower_msg):
+        result = await asyncio.to_thread(cancel_reservation, from_number, config["business_id"])
         if result["success"]:
             booking = result["booking"]
             reply = (
@@ -522,13 +927,21 @@ async def webhook(request: Request):
         else:
             reply = "Hubo un problema cancelando tu cita. Intenta de nuevo."
 
-    elif any(kw in incoming_msg.lower() for kw in reschedule_keywords):
+    elif RESCHEDULE_RE.search(lower_msg):
         try:
-            resolved_reschedule = resolve_dates(incoming_msg)
-            temp_reply = ask_openai(config, history, f"El cliente quiere cambiar su cita. Extrae SOLO la nueva fecha y hora de este mensaje y responde ÚNICAMENTE con el formato YYYY-MM-DD HH:MM, nada más. Si no hay fecha clara responde NO_DATE. Mensaje: {resolved_reschedule}")
+            resolved_reschedule = resolved_text
+            temp_reply = extract_local_datetime(resolved_reschedule, config)
+            if temp_reply and not bookable_slot(*temp_reply.split(" "), config):
+                temp_reply = None
+            if temp_reply is None and not DIGIT_RE.search(resolved_reschedule) and not DATE_WORD_RE.search(resolved_reschedule):
+                # Weekdays and "mañana" are already digits here; with no digits or spelled-out numbers or months
+                # there is no new slot to extract, so skip straight to asking for one.
+                temp_reply = "NO_DATE"
+            elif temp_reply is None:
+                temp_reply = await ask_openai(config, history, f"El cliente quiere cambiar su cita. Extrae SOLO la nueva fecha y hora de este mensaje y responde ÚNICAMENTE con el formato YYYY-MM-DD HH:MM, nada más. Si no hay fecha clara responde NO_DATE. Mensaje: {resolved_reschedule}")
             if temp_reply.strip() != "NO_DATE" and len(temp_reply.strip()) == 16:
                 new_datetime = temp_reply.strip()
-                result = reschedule_reservation(from_number, config["business_id"], new_datetime)
+                result = await asyncio.to_thread(reschedule_reservation, from_number, config["business_id"], new_datetime)
                 if result["success"]:
                     booking = result["booking"]
                     reply = (
@@ -550,9 +963,17 @@ async def webhook(request: Request):
             print(f"Reschedule OpenAI error: {e}")
             reply = "Claro, ¿para qué fecha y hora quieres cambiar tu cita? 📅"
 
+    elif (fast_reply := confirm_from_summary(history, incoming_msg, config)):
+        print(f"⚡ Confirmation handled locally for {from_number}")
+        reply = fast_reply
+
+    elif (local_summary := summary_from_message(resolved_text, config)):
+        print(f"⚡ Summary built locally for {from_number}")
+        reply = local_summary
+
     else:
         try:
-            reply = ask_openai(config, history, resolved_msg)
+            reply = await ask_openai_cached(config, history, resolved_msg)
         except Exception as e:
             print(f"OpenAI error: {e}")
             reply = "Hubo un error procesando tu mensaje. Intenta de nuevo."
@@ -568,11 +989,10 @@ async def webhook(request: Request):
         try:
             json_str = reply.split("RESERVA_CONFIRMADA:")[1].strip()
             json_end = json_str.index("}") + 1
-            extracted = json.loads(json_str[:json_end])
-            if not is_slot_available(extracted.get("datetime"), config["business_id"]):
+            extracted = orjson.loads(json_str[:json_end])
+            if not await asyncio.to_thread(book_reservation, from_number, config["business_id"], extracted):
                 reply = "Lo siento, ese horario ya está lleno 😅 ¿Puedes elegir otra hora?"
             else:
-                save_reservation(from_number, config["business_id"], extracted)
                 reply = (
                     f"✅ ¡Listo! Tu cita en {config['name']} está confirmada.\n\n"
                     f"👤 Nombre: {extracted.get('name')}\n"
@@ -590,9 +1010,7 @@ async def webhook(request: Request):
     session["history"] = history[-20:]
     save_session(from_number, session)
 
-    resp = MessagingResponse()
-    resp.message(reply)
-    return Response(content=str(resp), media_type="application/xml")
+    return twiml_message(reply)
 
 # =====================================================================
 # DASHBOARD AUTH
@@ -609,15 +1027,20 @@ def check_dashboard_auth(request: Request, business_id: int) -> bool:
 # DASHBOARD API ROUTES
 # =====================================================================
 
+def header_business_id(request: Request) -> int:
+    # A malformed header is just an unauthenticated request, not a ValueError traceback.
+    value = request.headers.get("X-Business-Id", "0").strip()
+    return int(value) if value.isascii() and value.isdigit() else 0
+
 @app.post("/api/reservation/{reservation_id}/cancel")
 async def api_cancel_reservation(reservation_id: int, request: Request):
     if not supabase:
         return JSONResponse({"success": False}, status_code=500)
-    business_id = int(request.headers.get("X-Business-Id", "0"))
+    business_id = header_business_id(request)
     if not check_dashboard_auth(request, business_id):
         return JSONResponse({"success": False}, status_code=401)
     try:
-        supabase.table("reservations").update({"status": "cancelled"}).eq("reservation_id", reservation_id).execute()
+        await asyncio.to_thread(supabase.table("reservations").update({"status": "cancelled"}).eq("reservation_id", reservation_id).execute)
         return JSONResponse({"success": True})
     except Exception as e:
         return JSONResponse({"success": False}, status_code=500)
@@ -626,11 +1049,11 @@ async def api_cancel_reservation(reservation_id: int, request: Request):
 async def api_complete_reservation(reservation_id: int, request: Request):
     if not supabase:
         return JSONResponse({"success": False}, status_code=500)
-    business_id = int(request.headers.get("X-Business-Id", "0"))
+    business_id = header_business_id(request)
     if not check_dashboard_auth(request, business_id):
         return JSONResponse({"success": False}, status_code=401)
     try:
-        supabase.table("reservations").update({"status": "completed"}).eq("reservation_id", reservation_id).execute()
+        await asyncio.to_thread(supabase.table("reservations").update({"status": "completed"}).eq("reservation_id", reservation_id).execute)
         return JSONResponse({"success": True})
     except Exception as e:
         return JSONResponse({"success": False}, status_code=500)
@@ -639,7 +1062,7 @@ async def api_complete_reservation(reservation_id: int, request: Request):
 async def api_edit_reservation(reservation_id: int, request: Request):
     if not supabase:
         return JSONResponse({"success": False}, status_code=500)
-    business_id = int(request.headers.get("X-Business-Id", "0"))
+    business_id = header_business_id(request)
     if not check_dashboard_auth(request, business_id):
         return JSONResponse({"success": False}, status_code=401)
     try:
@@ -654,32 +1077,39 @@ async def api_edit_reservation(reservation_id: int, request: Request):
             update_data["datetime"] = body["datetime"]
         if body.get("status") and body["status"] in allowed_statuses:
             update_data["status"] = body["status"]
-        supabase.table("reservations").update(update_data).eq("reservation_id", reservation_id).execute()
+        await asyncio.to_thread(supabase.table("reservations").update(update_data).eq("reservation_id", reservation_id).execute)
         return JSONResponse({"success": True})
     except Exception as e:
         return JSONResponse({"success": False}, status_code=500)
 
+@app.get("/api/calendar")
+async def api_calendar(request: Request, month: str = ""):
+    # Months before the current one aren't embedded in the page; calNav fetches them one at a time.
+    business_id = header_business_id(request)
+    if not check_dashboard_auth(request, business_id):
+        return JSONResponse({"success": False}, status_code=401)
+    try:
+        start = datetime.strptime(month, "%Y-%m").date()
+    except ValueError:
+        return JSONResponse({"success": False}, status_code=400)
+    end = (start + timedelta(days=31)).replace(day=1)
+    rows = await asyncio.to_thread(load_calendar_rows, business_id, start.isoformat(), end.isoformat())
+    return JSONResponse({"success": True, "rows": rows})
+
 @app.post("/api/reservation/walkin")
 async def api_walkin_booking(request: Request):
     if not supabase:
         return JSONResponse({"success": False}, status_code=500)
-    business_id_header = int(request.headers.get("X-Business-Id", "0"))
+    business_id_header = header_business_id(request)
     if not check_dashboard_auth(request, business_id_header):
         return JSONResponse({"success": False}, status_code=401)
     try:
         body = await request.json()
         business_id = body.get("business_id")
         datetime_str = body.get("datetime")
-        if not is_slot_available(datetime_str, business_id):
+        walkin = {"name": body.get("client_name"), "service": body.get("service"), "datetime": datetime_str}
+        if not await asyncio.to_thread(book_reservation, "presencial", business_id, walkin):
             return JSONResponse({"success": False, "reason": "slot_full"})
-        supabase.table("reservations").insert({
-            "contact_phone": "presencial",
-            "business_id": business_id,
-            "client_name": body.get("client_name"),
-            "service": body.get("service"),
-            "datetime": datetime_str,
-            "status": "confirmed"
-        }).execute()
         return JSONResponse({"success": True})
     except Exception as e:
         return JSONResponse({"success": False}, status_code=500)
@@ -704,22 +1134,225 @@ async def dashboard_login(business_id: int, request: Request):
 # DASHBOARD
 # =====================================================================
 
+DASHBOARD_COLUMNS = "reservation_id,client_name,service,datetime,status,contact_phone"
+CALENDAR_COLUMNS = "datetime,client_name,service,status"
+HISTORY_LIMIT = 50
+HISTORY_MAX_LIMIT = 200
+LIKE_WILDCARD_RE = re.compile(r"[%_*\\]")
+
 DIAS_ES = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"]
 DIAS_SHORT = ["Lun", "Mar", "Mié", "Jue", "Vie", "Sáb", "Dom"]
 MESES_ES = ["Ene", "Feb", "Mar", "Abr", "May", "Jun", "Jul", "Ago", "Sep", "Oct", "Nov", "Dic"]
 
-def format_datetime_display(dt_str: str) -> tuple[str, str]:
+def load_current_rows(business_id: int, month_start: str) -> list:
+    if not supabase:
+        return []
+    try:
+        result = supabase.table("reservations").select(DASHBOARD_COLUMNS).eq("business_id", business_id).gte("datetime", month_start).order("datetime").execute()
+        return result.data or []
+    except Exception as e:
+        print(f"Dashboard error: {e}")
+        return []
+
+def load_calendar_rows(business_id: int, start: str, end: str) -> list:
+    if not supabase:
+        return []
+    try:
+        result = supabase.table("reservations").select(CALENDAR_COLUMNS).eq("business_id", business_id).in_("status", ["confirmed", "completed"]).gte("datetime", start).lt("datetime", end).order("datetime").execute()
+        return result.data or []
+    except Exception as e:
+        print(f"Calendar error: {e}")
+        return []
+
+def load_history_rows(business_id: int, today_str: str, page: int = 0, size: int = HISTORY_LIMIT, q_name: str = "", q_phone: str = "") -> tuple[list, int]:
+    if not supabase:
+        return [], 0
+    try:
+        start = page * size
+        query = supabase.table("reservations").select(DASHBOARD_COLUMNS, count="exact").eq("business_id", business_id).lt("datetime", today_str)
+        # The search runs in SQL so it covers every page, not just the rows on screen.
+        if q_name:
+            query = query.ilike("client_name", f"%{q_name}%")
+        if q_phone:
+            query = query.ilike("contact_phone", f"%{q_phone}%")
+        result = query.order("datetime", desc=True).range(start, start + size - 1).execute()
+        rows = result.data or []
+        return rows, result.count or len(rows)
+    except Exception as e:
+        print(f"Dashboard history error: {e}")
+        return [], 0
+
+@lru_cache(maxsize=4096)
+def format_datetime_display(dt_str_clean: str) -> tuple[str, str]:
     try:
-        dt_str_clean = dt_str[:16].replace("T", " ")
-        dt = datetime.strptime(dt_str_clean, "%Y-%m-%d %H:%M")
+        if len(dt_str_clean) != 16:
+            raise ValueError(dt_str_clean)
+        dt = datetime.fromisoformat(dt_str_clean)
         dia = DIAS_SHORT[dt.weekday()]
         mes = MESES_ES[dt.month - 1]
-        hora = dt.strftime("%I:%M %p").lstrip("0")
+        hora = f"{dt.hour % 12 or 12}:{dt.minute:02d} {'AM' if dt.hour < 12 else 'PM'}"
         date_part = f"{dia} {dt.day} {mes}"
         return date_part, hora
-    except:
-        raw = dt_str[:16].replace("T", " ")
-        return raw, ""
+    except ValueError:
+        return dt_str_clean, ""
+
+# Static dashboard styles, kept out of the per-request f-string.
+DASHBOARD_CSS = """        :root {
+            --bg: #0f0f0f;
+            --surface: #1a1a1a;
+            --surface2: #222;
+            --border: #2a2a2a;
+            --text: #f0f0f0;
+            --muted: #666;
+            --muted2: #444;
+            --green: #22c55e;
+            --green-dim: rgba(34,197,94,0.12);
+            --green-border: rgba(34,197,94,0.25);
+            --red: #ef4444;
+            --red-dim: rgba(239,68,68,0.1);
+            --blue: #3b82f6;
+            --blue-dim: rgba(59,130,246,0.1);
+        }
+        * { margin:0; padding:0; box-sizing:border-box; }
+        body { font-family:'DM Sans',sans-serif; background:var(--bg); color:var(--text); min-height:100vh; }
+        .header { background:var(--surface); border-bottom:1px solid var(--border); padding:14px 24px; display:flex; align-items:center; justify-content:space-between; position:sticky; top:0; z-index:100; }
+        .brand { display:flex; align-items:center; gap:10px; }
+        .brand-icon { width:34px; height:34px; background:var(--green-dim); border:1px solid var(--green-border); border-radius:9px; display:flex; align-items:center; justify-content:center; font-size:17px; }
+        .brand-name { font-size:0.9rem; font-weight:600; }
+        .brand-sub { font-size:0.68rem; color:var(--muted); margin-top:1px; }
+        .header-right { display:flex; align-items:center; gap:8px; }
+        .live-badge { display:flex; align-items:center; gap:5px; background:var(--green-dim); border:1px solid var(--green-border); padding:4px 9px; border-radius:20px; font-size:0.7rem; color:var(--green); font-weight:500; }
+        .live-dot { width:5px; height:5px; background:var(--green); border-radius:50%; animation:pulse 2s infinite; }
+        @keyframes pulse { 0%,100%{opacity:1} 50%{opacity:0.3} }
+        .btn-presencial { background:var(--green); color:#000; border:none; padding:7px 13px; border-radius:8px; font-size:0.78rem; font-weight:700; cursor:pointer; font-family:inherit; }
+        .btn-refresh { background:var(--surface2); color:var(--muted); border:1px solid var(--border); padding:7px 11px; border-radius:8px; font-size:0.8rem; cursor:pointer; font-family:inherit; }
+        .tabs { background:var(--surface); border-bottom:1px solid var(--border); padding:0 24px; display:flex; }
+        .tab { padding:11px 16px; font-size:0.8rem; color:var(--muted); cursor:pointer; border-bottom:2px solid transparent; font-weight:500; transition:all 0.15s; display:flex; align-items:center; gap:5px; user-select:none; }
+        .tab.active { color:var(--text); border-bottom-color:var(--green); }
+        .tab-count { background:var(--surface2); color:var(--muted2); font-size:0.67rem; padding:1px 6px; border-radius:10px; font-family:'DM Mono',monospace; }
+        .tab.active .tab-count { background:var(--green-dim); color:var(--green); }
+        .tab-content { display:none; }
+        .tab-content.active { display:block; }
+        .container { max-width:1020px; margin:0 auto; padding:22px 20px; }
+        .stats-row { display:grid; grid-template-columns:repeat(4,1fr); gap:10px; margin-bottom:22px; }
+        .stat-card { background:var(--surface); border:1px solid var(--border); border-radius:11px; padding:14px 16px; }
+        .stat-label { font-size:0.68rem; color:var(--muted); text-transform:uppercase; letter-spacing:0.06em; margin-bottom:7px; }
+        .stat-value { font-size:1.55rem; font-weight:700; font-family:'DM Mono',monospace; line-height:1; }
+        .stat-sub { font-size:0.68rem; color:var(--muted); margin-top:4px; }
+        .stat-green .stat-value { color:var(--green); }
+        .stat-blue .stat-value { color:var(--blue); }
+        .section-header { display:flex; align-items:center; justify-content:space-between; margin-bottom:12px; }
+        .section-title { font-size:0.72rem; font-weight:600; color:var(--muted); text-transform:uppercase; letter-spacing:0.07em; }
+        .section-right { font-size:0.72rem; color:var(--muted); font-family:'DM Mono',monospace; }
+        .appt-list { display:flex; flex-direction:column; gap:7px; margin-bottom:26px; }
+        .appt-card { background:var(--surface); border:1px solid var(--border); border-radius:11px; padding:12px 14px; display:flex; align-items:center; gap:12px; transition:border-color 0.15s; }
+        .appt-card:hover { border-color:#333; }
+        .appt-time { font-family:'DM Mono',monospace; font-size:0.82rem; font-weight:500; min-width:62px; color:var(--text); }
+        .appt-sep { width:1px; height:28px; background:var(--border); flex-shrink:0; }
+        .appt-info { flex:1; min-width:0; }
+        .appt-name { font-size:0.85rem; font-weight:600; }
+        .appt-meta { font-size:0.72rem; color:var(--muted); margin-top:2px; }
+        .appt-actions { display:flex; gap:5px; align-items:center; flex-shrink:0; }
+        .badge { padding:3px 8px; border-radius:6px; font-size:0.68rem; font-weight:600; white-space:nowrap; flex-shrink:0; }
+        .badge-green { background:var(--green-dim); color:var(--green); }
+        .badge-blue { background:var(--blue-dim); color:var(--blue); }
+        .badge-red { background:var(--red-dim); color:var(--red); }
+        .btn-done { background:var(--green-dim); color:var(--green); border:1px solid var(--green-border); padding:5px 11px; border-radius:7px; font-size:0.73rem; font-weight:600; cursor:pointer; font-family:inherit; white-space:nowrap; }
+        .btn-done:hover { background:rgba(34,197,94,0.2); }
+        .dots-wrap { position:relative; display:inline-block; }
+        .btn-dots-sm { background:var(--surface2); color:var(--muted); border:1px solid var(--border); padding:5px 9px; border-radius:7px; font-size:0.85rem; cursor:pointer; font-family:inherit; }
+        .btn-edit-sm { background:var(--surface2); color:var(--muted); border:1px solid var(--border); padding:5px 9px; border-radius:7px; font-size:0.78rem; cursor:pointer; font-family:inherit; }
+        .drop-menu { display:none; position:absolute; right:0; top:110%; background:var(--surface); border:1px solid var(--border); border-radius:9px; box-shadow:0 8px 24px rgba(0,0,0,0.4); z-index:200; min-width:130px; overflow:hidden; text-align:left; }
+        .drop-menu.open { display:block; }
+        .drop-item { padding:9px 13px; font-size:0.8rem; cursor:pointer; color:var(--text); white-space:nowrap; }
+        .drop-item:hover { background:var(--surface2); }
+        .drop-item.danger { color:var(--red); }
+        .drop-item.danger:hover { background:var(--red-dim); }
+        .table-card { background:var(--surface); border:1px solid var(--border); border-radius:11px; overflow:visible; }
+        .table-header { padding:13px 16px; border-bottom:1px solid var(--border); display:flex; align-items:center; justify-content:space-between; gap:10px; flex-wrap:wrap; }
+        .search-row { display:flex; gap:7px; }
+        .search-input { background:var(--surface2); border:1px solid var(--border); color:var(--text); padding:6px 11px; border-radius:7px; font-size:0.77rem; font-family:inherit; outline:none; width:160px; }
+        .search-input::placeholder { color:var(--muted); }
+        .pager { display:flex; align-items:center; justify-content:space-between; gap:10px; padding:11px 16px; border-top:1px solid var(--border); }
+        .pager a { text-decoration:none; }
+        table { width:100%; border-collapse:collapse; table-layout:fixed; }
+        th { padding:9px 14px; text-align:left; font-size:0.67rem; font-weight:600; color:var(--muted); text-transform:uppercase; letter-spacing:0.05em; border-bottom:1px solid var(--border); }
+        td { padding:11px 14px; font-size:0.8rem; vertical-align:middle; overflow:hidden; }
+        tbody tr { border-bottom:1px solid var(--border); }
+        tbody tr:last-child { border-bottom:none; }
+        tr:hover td { background:rgba(255,255,255,0.015); }
+        .td-date { display:block; font-weight:500; }
+        .td-time { display:block; font-size:0.7rem; color:var(--muted); font-family:'DM Mono',monospace; margin-top:1px; }
+        .td-name { font-weight:500; }
+        .td-phone { font-size:0.75rem; color:var(--muted); font-family:'DM Mono',monospace; }
+        .td-actions { overflow:visible; }
+        table th:nth-child(1), table td:nth-child(1) { width:130px; }
+        table th:nth-child(2), table td:nth-child(2) { width:auto; }
+        table th:nth-child(3), table td:nth-child(3) { width:120px; }
+        table th:nth-child(4), table td:nth-child(4) { width:130px; }
+        table th:nth-child(5), table td:nth-child(5) { width:110px; }
+        table th:nth-child(6), table td:nth-child(6) { width:160px; overflow:visible; }
+        .cal-controls { display:flex; align-items:center; justify-content:space-between; margin-bottom:16px; flex-wrap:wrap; gap:10px; }
+        .cal-nav { display:flex; align-items:center; gap:8px; }
+        .cal-title { font-size:0.9rem; font-weight:600; font-family:'DM Mono',monospace; min-width:200px; text-align:center; }
+        .btn-nav { background:var(--surface2); border:1px solid var(--border); color:var(--muted); padding:5px 11px; border-radius:7px; cursor:pointer; font-family:inherit; font-size:0.82rem; }
+        .btn-nav:hover { color:var(--text); }
+        .btn-today { background:var(--green-dim); border:1px solid var(--green-border); color:var(--green); padding:5px 11px; border-radius:7px; cursor:pointer; font-family:inherit; font-size:0.75rem; font-weight:600; }
+        .view-toggle { display:flex; gap:4px; }
+        .btn-view { background:var(--surface2); border:1px solid var(--border); color:var(--muted); padding:5px 13px; border-radius:7px; cursor:pointer; font-family:inherit; font-size:0.75rem; font-weight:500; }
+        .btn-view.active { background:var(--green-dim); border-color:var(--green-border); color:var(--green); }
+        .week-grid { background:var(--surface); border:1px solid var(--border); border-radius:11px; overflow:hidden; }
+        .week-header { display:grid; grid-template-columns:56px repeat(6,1fr); border-bottom:1px solid var(--border); }
+        .week-hcell { padding:9px 6px; text-align:center; font-size:0.68rem; font-weight:600; color:var(--muted); text-transform:uppercase; letter-spacing:0.05em; border-right:1px solid var(--border); }
+        .week-hcell:last-child { border-right:none; }
+        .week-hcell .wdn { display:block; font-size:1rem; font-weight:700; color:var(--text); font-family:'DM Mono',monospace; margin-top:2px; line-height:1; }
+        .week-hcell.is-today .wdn { background:var(--green); color:#000; width:26px; height:26px; border-radius:50%; display:inline-flex; align-items:center; justify-content:center; margin-top:2px; }
+        .week-body { display:grid; grid-template-columns:56px repeat(6,1fr); max-height:480px; overflow-y:auto; }
+        .time-col { border-right:1px solid var(--border); }
+        .tslot { height:52px; padding:3px 6px; font-size:0.62rem; color:var(--muted); font-family:'DM Mono',monospace; border-bottom:1px solid var(--border); display:flex; align-items:flex-start; }
+        .dcol { border-right:1px solid var(--border); position:relative; }
+        .dcol:last-child { border-right:none; }
+        .dslot { height:52px; border-bottom:1px solid var(--border); padding:2px; position:relative; }
+        .cal-appt { position:absolute; left:2px; right:2px; top:2px; border-radius:5px; padding:2px 5px; font-size:0.64rem; font-weight:500; line-height:1.25; overflow:hidden; cursor:pointer; }
+        .cal-appt.g { background:var(--green-dim); border-left:2px solid var(--green); color:var(--green); }
+        .cal-appt.b { background:var(--blue-dim); border-left:2px solid var(--blue); color:var(--blue); }
+        .cal-appt.a { background:rgba(245,158,11,0.12); border-left:2px solid #f59e0b; color:#f59e0b; }
+        .month-grid { background:var(--surface); border:1px solid var(--border); border-radius:11px; overflow:hidden; }
+        .month-hrow { display:grid; grid-template-columns:repeat(6,1fr); border-bottom:1px solid var(--border); }
+        .month-hcell { padding:9px; text-align:center; font-size:0.68rem; font-weight:600; color:var(--muted); text-transform:uppercase; letter-spacing:0.05em; border-right:1px solid var(--border); }
+        .month-hcell:last-child { border-right:none; }
+        .month-body { display:grid; grid-template-columns:repeat(6,1fr); }
+        .mcell { min-height:80px; padding:6px; border-right:1px solid var(--border); border-bottom:1px solid var(--border); }
+        .mcell:nth-child(6n) { border-right:none; }
+        .mcell.dim { opacity:0.3; }
+        .mday { font-size:0.72rem; font-weight:600; font-family:'DM Mono',monospace; color:var(--muted); margin-bottom:3px; }
+        .mcell.is-today .mday { background:var(--green); color:#000; width:20px; height:20px; border-radius:50%; display:inline-flex; align-items:center; justify-content:center; }
+        .mappt { padding:2px 5px; border-radius:3px; font-size:0.6rem; font-weight:500; margin-bottom:2px; white-space:nowrap; overflow:hidden; text-overflow:ellipsis; cursor:pointer; }
+        .mappt.g { background:var(--green-dim); border-left:2px solid var(--green); color:var(--green); }
+        .mappt.b { background:var(--blue-dim); border-left:2px solid var(--blue); color:var(--blue); }
+        .mappt.a { background:rgba(245,158,11,0.12); border-left:2px solid #f59e0b; color:#f59e0b; }
+        .mmore { font-size:0.6rem; color:var(--muted); padding:1px 3px; cursor:pointer; }
+        .empty-state { text-align:center; padding:36px; color:var(--muted); font-size:0.82rem; }
+        .modal-overlay { display:none; position:fixed; top:0; left:0; width:100%; height:100%; background:rgba(0,0,0,0.7); z-index:300; justify-content:center; align-items:center; }
+        .modal-overlay.active { display:flex; }
+        .modal { background:var(--surface); border:1px solid var(--border); border-radius:14px; padding:26px; width:400px; max-width:95%; }
+        .modal h2 { font-size:1rem; font-weight:600; margin-bottom:18px; }
+        .modal label { display:block; font-size:0.75rem; color:var(--muted); margin-bottom:4px; margin-top:13px; }
+        .modal input, .modal select { width:100%; padding:8px 11px; background:var(--surface2); border:1px solid var(--border); border-radius:8px; font-size:0.85rem; color:var(--text); font-family:inherit; outline:none; }
+        .modal-actions { display:flex; gap:8px; margin-top:18px; justify-content:flex-end; }
+        .btn-save { background:var(--green); color:#000; border:none; padding:8px 16px; border-radius:8px; cursor:pointer; font-size:0.82rem; font-weight:700; font-family:inherit; }
+        .btn-cancel-modal { background:var(--surface2); color:var(--muted); border:1px solid var(--border); padding:8px 16px; border-radius:8px; cursor:pointer; font-size:0.82rem; font-family:inherit; }
+        .error-msg { color:var(--red); font-size:0.78rem; margin-top:7px; display:none; }
+        @media(max-width:640px) {
+            .stats-row { grid-template-columns:repeat(2,1fr); }
+            .header { padding:12px 16px; }
+            .container { padding:16px; }
+            .td-phone { display:none; }
+            .appt-meta { font-size:0.68rem; }
+        }
+"""
+
+JS_QUOTE = str.maketrans({"'": "\\'"})
 
 def format_price(service: str, config: dict) -> str:
     prices = config.get("service_prices", {})
@@ -727,7 +1360,7 @@ def format_price(service: str, config: dict) -> str:
     return f"${price:,}".replace(",", ".")
 
 @app.get("/dashboard/{business_id}", response_class=HTMLResponse)
-async def dashboard(request: Request, business_id: int):
+async def dashboard(request: Request, business_id: int, page: int = 0, size: int = HISTORY_LIMIT, q_name: str = "", q_phone: str = ""):
     if not check_dashboard_auth(request, business_id):
         login_html = f"""<!DOCTYPE html>
 <html lang="es">
@@ -776,13 +1409,21 @@ async def dashboard(request: Request, business_id: int):
 </html>"""
         return HTMLResponse(content=login_html)
 
-    reservations = []
-    if supabase:
-        try:
-            result = supabase.table("reservations").select("*").eq("business_id", business_id).order("datetime").execute()
-            reservations = result.data or []
-        except Exception as e:
-            print(f"Dashboard error: {e}")
+    page = max(page, 0)
+    size = min(max(size, 1), HISTORY_MAX_LIMIT)
+    q_name = LIKE_WILDCARD_RE.sub("", q_name).strip()
+    q_phone = LIKE_WILDCARD_RE.sub("", q_phone).strip()
+    history_filters = {k: v for k, v in (("q_name", q_name), ("q_phone", q_phone)) if v}
+
+    now = datetime.now(LOCAL_TZ)
+    today_str = now.date().isoformat()
+    current_month = today_str[:7]
+    month_start = f"{current_month}-01"
+
+    current_rows, (past_reservations, past_count) = await asyncio.gather(
+        asyncio.to_thread(load_current_rows, business_id, month_start),
+        asyncio.to_thread(load_history_rows, business_id, today_str, page, size, q_name, q_phone),
+    )
 
     business_name = "Negocio"
     business_services = []
@@ -794,26 +1435,39 @@ async def dashboard(request: Request, business_id: int):
             business_config = config
             break
 
-    today_str = datetime.now(LOCAL_TZ).strftime("%Y-%m-%d")
-    now = datetime.now(LOCAL_TZ)
-
-    today_reservations = [r for r in reservations if r.get("datetime", "")[:10] == today_str]
-    future_reservations = [r for r in reservations if r.get("datetime", "")[:10] > today_str]
-    past_reservations = [r for r in reservations if r.get("datetime", "")[:10] < today_str]
-
-    current_month = now.strftime("%Y-%m")
-    month_reservations = [r for r in reservations if r.get("datetime", "")[:7] == current_month and r.get("status") == "confirmed"]
-    month_completed = [r for r in reservations if r.get("datetime", "")[:7] == current_month and r.get("status") == "completed"]
-    month_all = month_reservations + month_completed
-    month_count = len(month_all)
-
     service_prices = business_config.get("service_prices", {})
     avg_price = business_config.get("avg_price", 35000)
-    month_revenue = sum(service_prices.get(r.get("service", ""), avg_price) for r in month_all)
-    month_cancelled = len([r for r in reservations if r.get("datetime", "")[:7] == current_month and r.get("status") == "cancelled"])
+
+    today_reservations = []
+    future_reservations = []
+    month_count = 0
+    month_revenue = 0
+    month_cancelled = 0
+    for r in current_rows:
+        dt = r.get("datetime") or ""
+        day = dt[:10]
+        if day == today_str:
+            today_reservations.append(r)
+        elif day > today_str:
+            future_reservations.append(r)
+        if dt[:7] == current_month:
+            status = r.get("status")
+            if status in ("confirmed", "completed"):
+                month_count += 1
+                month_revenue += service_prices.get(r.get("service", ""), avg_price)
+            elif status == "cancelled":
+                month_cancelled += 1
+
     today_count = len(today_reservations)
     upcoming_count = len(future_reservations)
 
+    history_pages = -(-past_count // size)
+    history_pager = ""
+    if history_pages > 1:
+        newer = f'<a class="btn-nav" href="?{urlencode({**history_filters, "page": page - 1, "size": size})}#historial">← Más recientes</a>' if page > 0 else "<span></span>"
+        older = f'<a class="btn-nav" href="?{urlencode({**history_filters, "page": page + 1, "size": size})}#historial">Más antiguas →</a>' if page + 1 < history_pages else "<span></span>"
+        history_pager = f'<div class="pager">{newer}<span class="section-right">Página {page + 1} de {history_pages}</span>{older}</div>'
+
     def fmt_currency(amount):
         if amount >= 1000000:
             return f"${amount/1000000:.1f}M"
@@ -824,41 +1478,41 @@ async def dashboard(request: Request, business_id: int):
     services_options = "".join([f'<option value="{s}">{s}</option>' for s in business_services])
     hours_options = "".join([f'<option value="{h:02d}:00">{h:02d}:00</option>' for h in range(9, 20)])
 
+    def row_actions(rid, status, name_safe, service_safe, dt_edit):
+        if status == "confirmed":
+            return '<span class="badge badge-green">Confirmada</span>', (
+                f'<button class="btn-done" onclick="completeReservation({rid})">✔ Listo</button>'
+                f'<div class="dots-wrap">'
+                f'<button class="btn-dots-sm" onclick="toggleDropdown(this)">⋯</button>'
+                f'<div class="drop-menu">'
+                f'<div class="drop-item" onclick="openEdit({rid},\'{name_safe}\',\'{service_safe}\',\'{dt_edit}\',\'{status}\')">✏️ Editar</div>'
+                f'<div class="drop-item danger" onclick="cancelReservation({rid})">✖ Cancelar</div>'
+                f'</div></div>'
+            )
+        edit = f'<button class="btn-edit-sm" onclick="openEdit({rid},\'{name_safe}\',\'{service_safe}\',\'{dt_edit}\',\'{status}\')">✏️</button>'
+        if status == "completed":
+            return '<span class="badge badge-blue">Completada</span>', edit
+        return '<span class="badge badge-red">Cancelada</span>', edit
+
     def build_today_cards(res_list):
         if not res_list:
             return '<div class="empty-state">Sin citas programadas para hoy</div>'
-        cards = ""
+        cards = []
         for r in res_list:
             rid = r.get("reservation_id")
             status = r.get("status", "-")
             dt = r.get("datetime", "")
-            date_part, time_part = format_datetime_display(dt)
+            dt_edit = dt[:16].replace("T", " ") if dt else ""
+            date_part, time_part = format_datetime_display(dt_edit)
             is_presencial = r.get("contact_phone") == "presencial"
             phone_display = "Presencial" if is_presencial else r.get("contact_phone", "-")
-            name_safe = r.get("client_name", "").replace("'", "\\'")
-            service_safe = r.get("service", "").replace("'", "\\'")
-            dt_edit = dt[:16].replace("T", " ") if dt else ""
+            name_safe = r.get("client_name", "").translate(JS_QUOTE)
+            service_safe = r.get("service", "").translate(JS_QUOTE)
             price = format_price(r.get("service", ""), business_config)
 
-            if status == "confirmed":
-                status_html = '<span class="badge badge-green">Confirmada</span>'
-                actions = (
-                    f'<button class="btn-done" onclick="completeReservation({rid})">✔ Listo</button>'
-                    f'<div class="dots-wrap">'
-                    f'<button class="btn-dots-sm" onclick="toggleDropdown(this)">⋯</button>'
-                    f'<div class="drop-menu">'
-                    f'<div class="drop-item" onclick="openEdit({rid},\'{name_safe}\',\'{service_safe}\',\'{dt_edit}\',\'{status}\')">✏️ Editar</div>'
-                    f'<div class="drop-item danger" onclick="cancelReservation({rid})">✖ Cancelar</div>'
-                    f'</div></div>'
-                )
-            elif status == "completed":
-                status_html = '<span class="badge badge-blue">Completada</span>'
-                actions = f'<button class="btn-edit-sm" onclick="openEdit({rid},\'{name_safe}\',\'{service_safe}\',\'{dt_edit}\',\'{status}\')">✏️</button>'
-            else:
-                status_html = '<span class="badge badge-red">Cancelada</span>'
-                actions = f'<button class="btn-edit-sm" onclick="openEdit({rid},\'{name_safe}\',\'{service_safe}\',\'{dt_edit}\',\'{status}\')">✏️</button>'
+            status_html, actions = row_actions(rid, status, name_safe, service_safe, dt_edit)
 
-            cards += f"""
+            cards.append(f"""
             <div class="appt-card">
                 <div class="appt-time">{time_part}</div>
                 <div class="appt-sep"></div>
@@ -868,43 +1522,27 @@ async def dashboard(request: Request, business_id: int):
                 </div>
                 {status_html}
                 <div class="appt-actions">{actions}</div>
-            </div>"""
-        return cards
+            </div>""")
+        return "".join(cards)
 
     def build_table_rows(res_list):
         if not res_list:
             return '<tr><td colspan="6" class="empty-state">Sin citas</td></tr>'
-        rows = ""
+        rows = []
         for r in res_list:
             rid = r.get("reservation_id")
             status = r.get("status", "-")
             dt = r.get("datetime", "")
-            date_part, time_part = format_datetime_display(dt)
+            dt_edit = dt[:16].replace("T", " ") if dt else ""
+            date_part, time_part = format_datetime_display(dt_edit)
             is_presencial = r.get("contact_phone") == "presencial"
             phone_display = "🚶 Presencial" if is_presencial else r.get("contact_phone", "-")
-            name_safe = r.get("client_name", "").replace("'", "\\'")
-            service_safe = r.get("service", "").replace("'", "\\'")
-            dt_edit = dt[:16].replace("T", " ") if dt else ""
+            name_safe = r.get("client_name", "").translate(JS_QUOTE)
+            service_safe = r.get("service", "").translate(JS_QUOTE)
 
-            if status == "confirmed":
-                status_html = '<span class="badge badge-green">Confirmada</span>'
-                actions = (
-                    f'<button class="btn-done" onclick="completeReservation({rid})">✔ Listo</button>'
-                    f'<div class="dots-wrap">'
-                    f'<button class="btn-dots-sm" onclick="toggleDropdown(this)">⋯</button>'
-                    f'<div class="drop-menu">'
-                    f'<div class="drop-item" onclick="openEdit({rid},\'{name_safe}\',\'{service_safe}\',\'{dt_edit}\',\'{status}\')">✏️ Editar</div>'
-                    f'<div class="drop-item danger" onclick="cancelReservation({rid})">✖ Cancelar</div>'
-                    f'</div></div>'
-                )
-            elif status == "completed":
-                status_html = '<span class="badge badge-blue">Completada</span>'
-                actions = f'<button class="btn-edit-sm" onclick="openEdit({rid},\'{name_safe}\',\'{service_safe}\',\'{dt_edit}\',\'{status}\')">✏️</button>'
-            else:
-                status_html = '<span class="badge badge-red">Cancelada</span>'
-                actions = f'<button class="btn-edit-sm" onclick="openEdit({rid},\'{name_safe}\',\'{service_safe}\',\'{dt_edit}\',\'{status}\')">✏️</button>'
+            status_html, actions = row_actions(rid, status, name_safe, service_safe, dt_edit)
 
-            rows += f"""
+            rows.append(f"""
             <tr>
                 <td><span class="td-date">{date_part}</span><span class="td-time">{time_part}</span></td>
                 <td class="td-name">{r.get("client_name", "-")}</td>
@@ -912,8 +1550,8 @@ async def dashboard(request: Request, business_id: int):
                 <td class="td-phone">{phone_display}</td>
                 <td>{status_html}</td>
                 <td class="td-actions">{actions}</td>
-            </tr>"""
-        return rows
+            </tr>""")
+        return "".join(rows)
 
     html = f"""<!DOCTYPE html>
 <html lang="es">
@@ -923,158 +1561,7 @@ async def dashboard(request: Request, business_id: int):
     <title>{business_name} — Panel</title>
     <link href="https://fonts.googleapis.com/css2?family=DM+Sans:ital,opsz,wght@0,9..40,300;0,9..40,400;0,9..40,500;0,9..40,600;0,9..40,700;1,9..40,400&family=DM+Mono:wght@400;500&display=swap" rel="stylesheet">
     <style>
-        :root {{
-            --bg: #0f0f0f;
-            --surface: #1a1a1a;
-            --surface2: #222;
-            --border: #2a2a2a;
-            --text: #f0f0f0;
-            --muted: #666;
-            --muted2: #444;
-            --green: #22c55e;
-            --green-dim: rgba(34,197,94,0.12);
-            --green-border: rgba(34,197,94,0.25);
-            --red: #ef4444;
-            --red-dim: rgba(239,68,68,0.1);
-            --blue: #3b82f6;
-            --blue-dim: rgba(59,130,246,0.1);
-        }}
-        * {{ margin:0; padding:0; box-sizing:border-box; }}
-        body {{ font-family:'DM Sans',sans-serif; background:var(--bg); color:var(--text); min-height:100vh; }}
-        .header {{ background:var(--surface); border-bottom:1px solid var(--border); padding:14px 24px; display:flex; align-items:center; justify-content:space-between; position:sticky; top:0; z-index:100; }}
-        .brand {{ display:flex; align-items:center; gap:10px; }}
-        .brand-icon {{ width:34px; height:34px; background:var(--green-dim); border:1px solid var(--green-border); border-radius:9px; display:flex; align-items:center; justify-content:center; font-size:17px; }}
-        .brand-name {{ font-size:0.9rem; font-weight:600; }}
-        .brand-sub {{ font-size:0.68rem; color:var(--muted); margin-top:1px; }}
-        .header-right {{ display:flex; align-items:center; gap:8px; }}
-        .live-badge {{ display:flex; align-items:center; gap:5px; background:var(--green-dim); border:1px solid var(--green-border); padding:4px 9px; border-radius:20px; font-size:0.7rem; color:var(--green); font-weight:500; }}
-        .live-dot {{ width:5px; height:5px; background:var(--green); border-radius:50%; animation:pulse 2s infinite; }}
-        @keyframes pulse {{ 0%,100%{{opacity:1}} 50%{{opacity:0.3}} }}
-        .btn-presencial {{ background:var(--green); color:#000; border:none; padding:7px 13px; border-radius:8px; font-size:0.78rem; font-weight:700; cursor:pointer; font-family:inherit; }}
-        .btn-refresh {{ background:var(--surface2); color:var(--muted); border:1px solid var(--border); padding:7px 11px; border-radius:8px; font-size:0.8rem; cursor:pointer; font-family:inherit; }}
-        .tabs {{ background:var(--surface); border-bottom:1px solid var(--border); padding:0 24px; display:flex; }}
-        .tab {{ padding:11px 16px; font-size:0.8rem; color:var(--muted); cursor:pointer; border-bottom:2px solid transparent; font-weight:500; transition:all 0.15s; display:flex; align-items:center; gap:5px; user-select:none; }}
-        .tab.active {{ color:var(--text); border-bottom-color:var(--green); }}
-        .tab-count {{ background:var(--surface2); color:var(--muted2); font-size:0.67rem; padding:1px 6px; border-radius:10px; font-family:'DM Mono',monospace; }}
-        .tab.active .tab-count {{ background:var(--green-dim); color:var(--green); }}
-        .tab-content {{ display:none; }}
-        .tab-content.active {{ display:block; }}
-        .container {{ max-width:1020px; margin:0 auto; padding:22px 20px; }}
-        .stats-row {{ display:grid; grid-template-columns:repeat(4,1fr); gap:10px; margin-bottom:22px; }}
-        .stat-card {{ background:var(--surface); border:1px solid var(--border); border-radius:11px; padding:14px 16px; }}
-        .stat-label {{ font-size:0.68rem; color:var(--muted); text-transform:uppercase; letter-spacing:0.06em; margin-bottom:7px; }}
-        .stat-value {{ font-size:1.55rem; font-weight:700; font-family:'DM Mono',monospace; line-height:1; }}
-        .stat-sub {{ font-size:0.68rem; color:var(--muted); margin-top:4px; }}
-        .stat-green .stat-value {{ color:var(--green); }}
-        .stat-blue .stat-value {{ color:var(--blue); }}
-        .section-header {{ display:flex; align-items:center; justify-content:space-between; margin-bottom:12px; }}
-        .section-title {{ font-size:0.72rem; font-weight:600; color:var(--muted); text-transform:uppercase; letter-spacing:0.07em; }}
-        .section-right {{ font-size:0.72rem; color:var(--muted); font-family:'DM Mono',monospace; }}
-        .appt-list {{ display:flex; flex-direction:column; gap:7px; margin-bottom:26px; }}
-        .appt-card {{ background:var(--surface); border:1px solid var(--border); border-radius:11px; padding:12px 14px; display:flex; align-items:center; gap:12px; transition:border-color 0.15s; }}
-        .appt-card:hover {{ border-color:#333; }}
-        .appt-time {{ font-family:'DM Mono',monospace; font-size:0.82rem; font-weight:500; min-width:62px; color:var(--text); }}
-        .appt-sep {{ width:1px; height:28px; background:var(--border); flex-shrink:0; }}
-        .appt-info {{ flex:1; min-width:0; }}
-        .appt-name {{ font-size:0.85rem; font-weight:600; }}
-        .appt-meta {{ font-size:0.72rem; color:var(--muted); margin-top:2px; }}
-        .appt-actions {{ display:flex; gap:5px; align-items:center; flex-shrink:0; }}
-        .badge {{ padding:3px 8px; border-radius:6px; font-size:0.68rem; font-weight:600; white-space:nowrap; flex-shrink:0; }}
-        .badge-green {{ background:var(--green-dim); color:var(--green); }}
-        .badge-blue {{ background:var(--blue-dim); color:var(--blue); }}
-        .badge-red {{ background:var(--red-dim); color:var(--red); }}
-        .btn-done {{ background:var(--green-dim); color:var(--green); border:1px solid var(--green-border); padding:5px 11px; border-radius:7px; font-size:0.73rem; font-weight:600; cursor:pointer; font-family:inherit; white-space:nowrap; }}
-        .btn-done:hover {{ background:rgba(34,197,94,0.2); }}
-        .dots-wrap {{ position:relative; display:inline-block; }}
-        .btn-dots-sm {{ background:var(--surface2); color:var(--muted); border:1px solid var(--border); padding:5px 9px; border-radius:7px; font-size:0.85rem; cursor:pointer; font-family:inherit; }}
-        .btn-edit-sm {{ background:var(--surface2); color:var(--muted); border:1px solid var(--border); padding:5px 9px; border-radius:7px; font-size:0.78rem; cursor:pointer; font-family:inherit; }}
-        .drop-menu {{ display:none; position:absolute; right:0; top:110%; background:var(--surface); border:1px solid var(--border); border-radius:9px; box-shadow:0 8px 24px rgba(0,0,0,0.4); z-index:200; min-width:130px; overflow:hidden; text-align:left; }}
-        .drop-menu.open {{ display:block; }}
-        .drop-item {{ padding:9px 13px; font-size:0.8rem; cursor:pointer; color:var(--text); white-space:nowrap; }}
-        .drop-item:hover {{ background:var(--surface2); }}
-        .drop-item.danger {{ color:var(--red); }}
-        .drop-item.danger:hover {{ background:var(--red-dim); }}
-        .table-card {{ background:var(--surface); border:1px solid var(--border); border-radius:11px; overflow:visible; }}
-        .table-header {{ padding:13px 16px; border-bottom:1px solid var(--border); display:flex; align-items:center; justify-content:space-between; gap:10px; flex-wrap:wrap; }}
-        .search-row {{ display:flex; gap:7px; }}
-        .search-input {{ background:var(--surface2); border:1px solid var(--border); color:var(--text); padding:6px 11px; border-radius:7px; font-size:0.77rem; font-family:inherit; outline:none; width:160px; }}
-        .search-input::placeholder {{ color:var(--muted); }}
-        table {{ width:100%; border-collapse:collapse; table-layout:fixed; }}
-        th {{ padding:9px 14px; text-align:left; font-size:0.67rem; font-weight:600; color:var(--muted); text-transform:uppercase; letter-spacing:0.05em; border-bottom:1px solid var(--border); }}
-        td {{ padding:11px 14px; font-size:0.8rem; vertical-align:middle; overflow:hidden; }}
-        tbody tr {{ border-bottom:1px solid var(--border); }}
-        tbody tr:last-child {{ border-bottom:none; }}
-        tr:hover td {{ background:rgba(255,255,255,0.015); }}
-        .td-date {{ display:block; font-weight:500; }}
-        .td-time {{ display:block; font-size:0.7rem; color:var(--muted); font-family:'DM Mono',monospace; margin-top:1px; }}
-        .td-name {{ font-weight:500; }}
-        .td-phone {{ font-size:0.75rem; color:var(--muted); font-family:'DM Mono',monospace; }}
-        .td-actions {{ overflow:visible; }}
-        table th:nth-child(1), table td:nth-child(1) {{ width:130px; }}
-        table th:nth-child(2), table td:nth-child(2) {{ width:auto; }}
-        table th:nth-child(3), table td:nth-child(3) {{ width:120px; }}
-        table th:nth-child(4), table td:nth-child(4) {{ width:130px; }}
-        table th:nth-child(5), table td:nth-child(5) {{ width:110px; }}
-        table th:nth-child(6), table td:nth-child(6) {{ width:160px; overflow:visible; }}
-        .cal-controls {{ display:flex; align-items:center; justify-content:space-between; margin-bottom:16px; flex-wrap:wrap; gap:10px; }}
-        .cal-nav {{ display:flex; align-items:center; gap:8px; }}
-        .cal-title {{ font-size:0.9rem; font-weight:600; font-family:'DM Mono',monospace; min-width:200px; text-align:center; }}
-        .btn-nav {{ background:var(--surface2); border:1px solid var(--border); color:var(--muted); padding:5px 11px; border-radius:7px; cursor:pointer; font-family:inherit; font-size:0.82rem; }}
-        .btn-nav:hover {{ color:var(--text); }}
-        .btn-today {{ background:var(--green-dim); border:1px solid var(--green-border); color:var(--green); padding:5px 11px; border-radius:7px; cursor:pointer; font-family:inherit; font-size:0.75rem; font-weight:600; }}
-        .view-toggle {{ display:flex; gap:4px; }}
-        .btn-view {{ background:var(--surface2); border:1px solid var(--border); color:var(--muted); padding:5px 13px; border-radius:7px; cursor:pointer; font-family:inherit; font-size:0.75rem; font-weight:500; }}
-        .btn-view.active {{ background:var(--green-dim); border-color:var(--green-border); color:var(--green); }}
-        .week-grid {{ background:var(--surface); border:1px solid var(--border); border-radius:11px; overflow:hidden; }}
-        .week-header {{ display:grid; grid-template-columns:56px repeat(6,1fr); border-bottom:1px solid var(--border); }}
-        .week-hcell {{ padding:9px 6px; text-align:center; font-size:0.68rem; font-weight:600; color:var(--muted); text-transform:uppercase; letter-spacing:0.05em; border-right:1px solid var(--border); }}
-        .week-hcell:last-child {{ border-right:none; }}
-        .week-hcell .wdn {{ display:block; font-size:1rem; font-weight:700; color:var(--text); font-family:'DM Mono',monospace; margin-top:2px; line-height:1; }}
-        .week-hcell.is-today .wdn {{ background:var(--green); color:#000; width:26px; height:26px; border-radius:50%; display:inline-flex; align-items:center; justify-content:center; margin-top:2px; }}
-        .week-body {{ display:grid; grid-template-columns:56px repeat(6,1fr); max-height:480px; overflow-y:auto; }}
-        .time-col {{ border-right:1px solid var(--border); }}
-        .tslot {{ height:52px; padding:3px 6px; font-size:0.62rem; color:var(--muted); font-family:'DM Mono',monospace; border-bottom:1px solid var(--border); display:flex; align-items:flex-start; }}
-        .dcol {{ border-right:1px solid var(--border); position:relative; }}
-        .dcol:last-child {{ border-right:none; }}
-        .dslot {{ height:52px; border-bottom:1px solid var(--border); padding:2px; position:relative; }}
-        .cal-appt {{ position:absolute; left:2px; right:2px; top:2px; border-radius:5px; padding:2px 5px; font-size:0.64rem; font-weight:500; line-height:1.25; overflow:hidden; cursor:pointer; }}
-        .cal-appt.g {{ background:var(--green-dim); border-left:2px solid var(--green); color:var(--green); }}
-        .cal-appt.b {{ background:var(--blue-dim); border-left:2px solid var(--blue); color:var(--blue); }}
-        .cal-appt.a {{ background:rgba(245,158,11,0.12); border-left:2px solid #f59e0b; color:#f59e0b; }}
-        .month-grid {{ background:var(--surface); border:1px solid var(--border); border-radius:11px; overflow:hidden; }}
-        .month-hrow {{ display:grid; grid-template-columns:repeat(6,1fr); border-bottom:1px solid var(--border); }}
-        .month-hcell {{ padding:9px; text-align:center; font-size:0.68rem; font-weight:600; color:var(--muted); text-transform:uppercase; letter-spacing:0.05em; border-right:1px solid var(--border); }}
-        .month-hcell:last-child {{ border-right:none; }}
-        .month-body {{ display:grid; grid-template-columns:repeat(6,1fr); }}
-        .mcell {{ min-height:80px; padding:6px; border-right:1px solid var(--border); border-bottom:1px solid var(--border); }}
-        .mcell:nth-child(6n) {{ border-right:none; }}
-        .mcell.dim {{ opacity:0.3; }}
-        .mday {{ font-size:0.72rem; font-weight:600; font-family:'DM Mono',monospace; color:var(--muted); margin-bottom:3px; }}
-        .mcell.is-today .mday {{ background:var(--green); color:#000; width:20px; height:20px; border-radius:50%; display:inline-flex; align-items:center; justify-content:center; }}
-        .mappt {{ padding:2px 5px; border-radius:3px; font-size:0.6rem; font-weight:500; margin-bottom:2px; white-space:nowrap; overflow:hidden; text-overflow:ellipsis; cursor:pointer; }}
-        .mappt.g {{ background:var(--green-dim); border-left:2px solid var(--green); color:var(--green); }}
-        .mappt.b {{ background:var(--blue-dim); border-left:2px solid var(--blue); color:var(--blue); }}
-        .mappt.a {{ background:rgba(245,158,11,0.12); border-left:2px solid #f59e0b; color:#f59e0b; }}
-        .mmore {{ font-size:0.6rem; color:var(--muted); padding:1px 3px; cursor:pointer; }}
-        .empty-state {{ text-align:center; padding:36px; color:var(--muted); font-size:0.82rem; }}
-        .modal-overlay {{ display:none; position:fixed; top:0; left:0; width:100%; height:100%; background:rgba(0,0,0,0.7); z-index:300; justify-content:center; align-items:center; }}
-        .modal-overlay.active {{ display:flex; }}
-        .modal {{ background:var(--surface); border:1px solid var(--border); border-radius:14px; padding:26px; width:400px; max-width:95%; }}
-        .modal h2 {{ font-size:1rem; font-weight:600; margin-bottom:18px; }}
-        .modal label {{ display:block; font-size:0.75rem; color:var(--muted); margin-bottom:4px; margin-top:13px; }}
-        .modal input, .modal select {{ width:100%; padding:8px 11px; background:var(--surface2); border:1px solid var(--border); border-radius:8px; font-size:0.85rem; color:var(--text); font-family:inherit; outline:none; }}
-        .modal-actions {{ display:flex; gap:8px; margin-top:18px; justify-content:flex-end; }}
-        .btn-save {{ background:var(--green); color:#000; border:none; padding:8px 16px; border-radius:8px; cursor:pointer; font-size:0.82rem; font-weight:700; font-family:inherit; }}
-        .btn-cancel-modal {{ background:var(--surface2); color:var(--muted); border:1px solid var(--border); padding:8px 16px; border-radius:8px; cursor:pointer; font-size:0.82rem; font-family:inherit; }}
-        .error-msg {{ color:var(--red); font-size:0.78rem; margin-top:7px; display:none; }}
-        @media(max-width:640px) {{
-            .stats-row {{ grid-template-columns:repeat(2,1fr); }}
-            .header {{ padding:12px 16px; }}
-            .container {{ padding:16px; }}
-            .td-phone {{ display:none; }}
-            .appt-meta {{ font-size:0.68rem; }}
-        }}
-    </style>
+{DASHBOARD_CSS}    </style>
 </head>
 <body>
 
@@ -1096,7 +1583,7 @@ async def dashboard(request: Request, business_id: int):
 <div class="tabs">
     <div class="tab active" onclick="switchTab('hoy',this)">📅 Hoy <span class="tab-count">{today_count}</span></div>
     <div class="tab" onclick="switchTab('proximas',this)">🗓 Próximas <span class="tab-count">{upcoming_count}</span></div>
-    <div class="tab" onclick="switchTab('historial',this)">🕐 Historial <span class="tab-count">{len(past_reservations)}</span></div>
+    <div class="tab" onclick="switchTab('historial',this)">🕐 Historial <span class="tab-count">{past_count}</span></div>
     <div class="tab" onclick="switchTab('calendario',this)">📆 Calendario</div>
 </div>
 
@@ -1154,14 +1641,15 @@ async def dashboard(request: Request, business_id: int):
             <div class="table-header">
                 <div class="section-title">Historial</div>
                 <div class="search-row">
-                    <input class="search-input" id="searchHistName" placeholder="Nombre..." oninput="filterHistorial()">
-                    <input class="search-input" id="searchHistPhone" placeholder="Teléfono..." oninput="filterHistorial()" style="width:130px">
+                    <input class="search-input" id="searchHistName" placeholder="Nombre..." value="{xml_escape(q_name, {'"': '&quot;'})}" onchange="filterHistorial()">
+                    <input class="search-input" id="searchHistPhone" placeholder="Teléfono..." value="{xml_escape(q_phone, {'"': '&quot;'})}" onchange="filterHistorial()" style="width:130px">
                 </div>
             </div>
             <table>
                 <thead><tr><th>Fecha & Hora</th><th>Cliente</th><th>Servicio</th><th>Teléfono</th><th>Estado</th><th>Acciones</th></tr></thead>
                 <tbody id="historialBody">{build_table_rows(past_reservations)}</tbody>
             </table>
+            {history_pager}
         </div>
     </div>
 
@@ -1244,7 +1732,10 @@ async def dashboard(request: Request, business_id: int):
 <script>
     const BIZ_ID = '{business_id}';
 
-    const CAL_DATA = {json.dumps([{"datetime": r.get("datetime",""), "client_name": r.get("client_name",""), "service": r.get("service",""), "status": r.get("status","")} for r in reservations if r.get("status") in ["confirmed","completed"]])};
+    const CAL_DATA = {orjson.dumps([{"datetime": r.get("datetime",""), "client_name": r.get("client_name",""), "service": r.get("service",""), "status": r.get("status","")} for r in current_rows if r.get("status") in ["confirmed","completed"]]).decode()};
+    // CAL_DATA covers {current_month} onward; earlier months are fetched on demand.
+    const CAL_FROM = '{current_month}';
+    const calLoaded = new Set();
     const DIAS_CAL = ['Lun','Mar','Mié','Jue','Vie','Sáb'];
     const MESES_CAL = ['Enero','Febrero','Marzo','Abril','Mayo','Junio','Julio','Agosto','Septiembre','Octubre','Noviembre','Diciembre'];
     const CAL_HOURS = [9,10,11,12,13,14,15,16,17,18];
@@ -1329,7 +1820,32 @@ async def dashboard(request: Request, business_id: int):
         document.getElementById('monthBody').innerHTML = cells;
     }}
 
-    function calRender() {{ if(calView==='week') calRenderWeek(); else calRenderMonth(); }}
+    function calMonthKey(d) {{ return `${{d.getFullYear()}}-${{String(d.getMonth()+1).padStart(2,'0')}}`; }}
+    function calVisibleMonths() {{
+        if (calView !== 'week') return [calMonthKey(calDate)];
+        const ws = calWeekStart(calDate);
+        const we = new Date(ws); we.setDate(ws.getDate()+5);
+        return [...new Set([calMonthKey(ws), calMonthKey(we)])];
+    }}
+    async function calLoadMonths(months) {{
+        const missing = months.filter(m => m < CAL_FROM && !calLoaded.has(m));
+        if (!missing.length) return false;
+        missing.forEach(m => calLoaded.add(m));
+        let added = false;
+        await Promise.all(missing.map(async m => {{
+            try {{
+                const res = await fetch(`/api/calendar?month=${{m}}`, {{ headers:{{'X-Business-Id':BIZ_ID}} }});
+                const result = await res.json();
+                if (result.success) {{ CAL_DATA.push(...result.rows); added = true; }}
+                else calLoaded.delete(m);
+            }} catch (e) {{ calLoaded.delete(m); }}
+        }}));
+        return added;
+    }}
+    function calRender() {{
+        if(calView==='week') calRenderWeek(); else calRenderMonth();
+        calLoadMonths(calVisibleMonths()).then(added => {{ if (added) calRender(); }});
+    }}
     function calNav(dir) {{
         if(calView==='week') calDate.setDate(calDate.getDate()+dir*7);
         else calDate.setMonth(calDate.getMonth()+dir);
@@ -1345,6 +1861,9 @@ async def dashboard(request: Request, business_id: int):
         calRender();
     }}
     document.addEventListener('DOMContentLoaded', () => {{ if(document.getElementById('calTitle')) calRender(); }});
+    document.addEventListener('DOMContentLoaded', () => {{
+        if (location.hash === '#historial') switchTab('historial', document.querySelector('.tab[onclick*="historial"]'));
+    }});
 
     function switchTab(name, el) {{
         document.querySelectorAll('.tab').forEach(t => t.classList.remove('active'));
@@ -1381,15 +1900,14 @@ async def dashboard(request: Request, business_id: int):
     }}
 
     function filterHistorial() {{
-        const name = document.getElementById('searchHistName').value.toLowerCase();
-        const phone = document.getElementById('searchHistPhone').value.toLowerCase();
-        document.querySelectorAll('#historialBody tr').forEach(row => {{
-            const cells = row.querySelectorAll('td');
-            if (cells.length < 4) return;
-            const matchName = cells[1].textContent.toLowerCase().includes(name);
-            const matchPhone = cells[3].textContent.toLowerCase().includes(phone);
-            row.style.display = (matchName && matchPhone) ? '' : 'none';
-        }});
+        // History is paged server-side, so the search reloads from page 0 with the filter applied.
+        const params = new URLSearchParams();
+        const name = document.getElementById('searchHistName').value.trim();
+        const phone = document.getElementById('searchHistPhone').value.trim();
+        if (name) params.set('q_name', name);
+        if (phone) params.set('q_phone', phone);
+        params.set('size', '{size}');
+        location.href = '?' + params.toString() + '#historial';
     }}
 
     function openEdit(id, name, service, datetime, status) {{
@@ -1477,7 +1995,12 @@ async def dashboard(request: Request, business_id: int):
 </script>
 </body>
 </html>"""
-    return HTMLResponse(content=html)
+    # Revalidate every load; unchanged pages come back as an empty 304
+    etag = '"' + hashlib.blake2b(html.encode(), digest_size=16).hexdigest() + '"'
+    cache_headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=cache_headers)
+    return HTMLResponse(content=html, headers=cache_headers)
 
 # =====================================================================
 # HEALTH CHECK
@@ -0,0 +1,42 @@
+-- Atomically check slot capacity and insert a confirmed reservation.
+-- Called from main.py via supabase.rpc("book_reservation", {...}).
+-- Returns true when the reservation was inserted, false when the slot is full.
+create or replace function book_reservation(
+    p_business_id integer,
+    p_contact_phone text,
+    p_client_name text,
+    p_service text,
+    p_datetime timestamp,
+    p_capacity integer default 3
+) returns boolean
+language plpgsql
+as $$
+begin
+    -- Serialize concurrent bookings for the same business + slot.
+    perform pg_advisory_xact_lock(p_business_id, hashtext(p_datetime::text));
+
+    -- A retried confirmation for a slot this client already holds is a success, not a new row.
+    if p_contact_phone <> 'presencial' and exists (
+        select 1 from reservations
+        where business_id = p_business_id
+          and contact_phone = p_contact_phone
+          and datetime = p_datetime
+          and status = 'confirmed'
+    ) then
+        return true;
+    end if;
+
+    if (
+        select count(*) from reservations
+        where business_id = p_business_id
+          and datetime = p_datetime
+          and status = 'confirmed'
+    ) >= p_capacity then
+        return false;
+    end if;
+
+    insert into reservations (contact_phone, business_id, client_name, service, datetime, status)
+    values (p_contact_phone, p_business_id, p_client_name, p_service, p_datetime, 'confirmed');
+    return true;
+end;
+$$;
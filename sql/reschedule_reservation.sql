@@ -0,0 +1,45 @@
+-- Atomically move a client's latest confirmed reservation to a new slot.
+-- Called from main.py via supabase.rpc("reschedule_reservation", {...}).
+-- Returns {"booking": {...}} on success, or {"reason": "no_booking" | "slot_full"}.
+create or replace function reschedule_reservation(
+    p_business_id integer,
+    p_contact_phone text,
+    p_datetime timestamp,
+    p_capacity integer default 3
+) returns jsonb
+language plpgsql
+as $$
+declare
+    v_booking reservations;
+begin
+    select * into v_booking from reservations
+    where contact_phone = p_contact_phone
+      and business_id = p_business_id
+      and status = 'confirmed'
+    order by datetime desc
+    limit 1
+    for update;
+
+    if not found then
+        return jsonb_build_object('reason', 'no_booking');
+    end if;
+
+    -- Same lock key as book_reservation, so bookings and reschedules into a slot serialize.
+    perform pg_advisory_xact_lock(p_business_id, hashtext(p_datetime::text));
+
+    if (
+        select count(*) from reservations
+        where business_id = p_business_id
+          and datetime = p_datetime
+          and status = 'confirmed'
+    ) >= p_capacity then
+        return jsonb_build_object('reason', 'slot_full');
+    end if;
+
+    update reservations set datetime = p_datetime
+    where reservation_id = v_booking.reservation_id;
+
+    v_booking.datetime := p_datetime;
+    return jsonb_build_object('booking', to_jsonb(v_booking));
+end;
+$$;
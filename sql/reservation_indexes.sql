@@ -0,0 +1,32 @@
+-- Indexes for the reservation lookups main.py runs on every webhook and dashboard load.
+
+-- Slot capacity checks, availability windows and the book/reschedule RPCs:
+-- business_id = ? and status = 'confirmed' and datetime = ? / between ? and ?
+create index if not exists reservations_business_status_datetime_idx
+    on reservations (business_id, status, datetime);
+
+-- Cancel/reschedule: latest confirmed booking for a phone number.
+create index if not exists reservations_phone_business_status_datetime_idx
+    on reservations (contact_phone, business_id, status, datetime desc);
+
+-- Dashboard month view and paginated history: business_id = ? ordered by datetime.
+create index if not exists reservations_business_datetime_idx
+    on reservations (business_id, datetime);
+
+-- One confirmed booking per client per slot. Walk-ins all share the 'presencial' phone, so they are exempt.
+-- Older code could confirm the same client into a slot twice, and the unique index would fail on
+-- those rows, so first cancel every duplicate except the earliest (lowest reservation_id).
+update reservations r
+set status = 'cancelled'
+from reservations keep
+where r.status = 'confirmed'
+  and r.contact_phone <> 'presencial'
+  and keep.status = 'confirmed'
+  and keep.business_id = r.business_id
+  and keep.contact_phone = r.contact_phone
+  and keep.datetime = r.datetime
+  and keep.reservation_id < r.reservation_id;
+
+create unique index if not exists reservations_client_slot_uniq
+    on reservations (business_id, contact_phone, datetime)
+    where status = 'confirmed' and contact_phone <> 'presencial';
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# main builds its OpenAI client at import; the parsers under test never call it.
+os.environ.setdefault("OPENAI_API_KEY", "test")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
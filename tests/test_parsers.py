@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta
+
+import main
+
+CONFIG = main.BUSINESS_CONFIGS["+14155238886"]
+
+def open_day(offset=1):
+    day = datetime.now(main.LOCAL_TZ).date() + timedelta(days=offset)
+    while day.weekday() == 6:
+        day += timedelta(days=1)
+    return day.isoformat()
+
+def summary_history(date, time):
+    content = main.format_confirmation({"name": "Ana", "service": "Corte", "date": date, "time": time})
+    return [{"role": "assistant", "content": content}]
+
+# CONFIRM_CLOCK_RE
+
+def test_confirm_clock_keeps_dotted_suffix():
+    assert main.CONFIRM_CLOCK_RE.search("🕒 Hora: 3:00 p.m.\n").group(1) == "3:00 p.m."
+    assert main.CONFIRM_CLOCK_RE.search("🕒 Hora: 10:30 a. m. ").group(1) == "10:30 a. m."
+
+def test_confirm_clock_plain_forms():
+    assert main.CONFIRM_CLOCK_RE.search("Hora: 3:00 PM").group(1) == "3:00 PM"
+    assert main.CONFIRM_CLOCK_RE.search("Hora: 15:00\n").group(1) == "15:00"
+    assert main.CONFIRM_CLOCK_RE.search("Hora: 3:00 pmx").group(1) == "3:00"
+
+# extract_local_datetime
+
+def test_extract_single_slot():
+    day = open_day(3)
+    assert main.extract_local_datetime(f"cambiar para {day} a las 4 pm", CONFIG) == f"{day} 16:00"
+    assert main.extract_local_datetime(f"cambiar al {day} a las 16:00", CONFIG) == f"{day} 16:00"
+    assert main.extract_local_datetime(f"cambiar al {day} 16:00", CONFIG) == f"{day} 16:00"
+
+def test_extract_two_dates_goes_to_model():
+    assert main.extract_local_datetime(f"cambiar de {open_day(1)} para {open_day(3)} a las 4 pm", CONFIG) is None
+
+def test_extract_two_times_goes_to_model():
+    assert main.extract_local_datetime(f"cambiar de las 3 pm a las 5 pm del {open_day(3)}", CONFIG) is None
+
+def test_extract_ambiguous_hour_goes_to_model():
+    assert main.extract_local_datetime(f"cambiar al {open_day(3)} a las 3", CONFIG) is None
+
+# summary_from_message
+
+def test_summary_built_locally():
+    day = open_day(2)
+    summary = main.summary_from_message(f"Soy Ana Gómez, corte {day} a las 3 pm", CONFIG)
+    assert "👤 Nombre: Ana Gómez" in summary
+    assert "✂️ Servicio: Corte" in summary
+    assert f"📅 Fecha: {day}" in summary
+    assert "🕒 Hora: 3:00 PM" in summary
+
+def test_summary_rejects_past_impossible_and_off_grid():
+    assert main.summary_from_message("Soy Ana, corte 2020-01-01 a las 3 pm", CONFIG) is None
+    assert main.summary_from_message("Soy Ana, corte 2027-02-30 a las 3 pm", CONFIG) is None
+    assert main.summary_from_message(f"Soy Ana, corte {open_day(2)} a las 3:10 pm", CONFIG) is None
+    assert main.summary_from_message(f"Soy Ana, corte {open_day(2)} a las 7 pm", CONFIG) is None
+
+def test_summary_needs_a_real_name():
+    assert main.summary_from_message(f"Soy Muy Feliz de escribir, corte {open_day(2)} a las 3 pm", CONFIG) is None
+
+# confirm_from_summary
+
+def test_confirm_books_future_slot():
+    day = open_day(2)
+    reply = main.confirm_from_summary(summary_history(day, "3:00 PM"), "sí", CONFIG)
+    assert reply == 'RESERVA_CONFIRMADA:{"name":"Ana","service":"Corte","datetime":"%s 15:00"}' % day
+
+def test_confirm_reads_dotted_pm():
+    day = open_day(2)
+    reply = main.confirm_from_summary(summary_history(day, "3:00 p.m."), "confirmo", CONFIG)
+    assert reply.endswith(f'"{day} 15:00"}}')
+
+def test_confirm_leaves_unsafe_turns_to_model():
+    assert main.confirm_from_summary(summary_history("2020-01-01", "3:00 PM"), "sí", CONFIG) is None
+    assert main.confirm_from_summary(summary_history("2027-02-30", "3:00 PM"), "sí", CONFIG) is None
+    assert main.confirm_from_summary(summary_history(open_day(2), "3:00"), "sí", CONFIG) is None
+    assert main.confirm_from_summary(summary_history(open_day(2), "3:00 PM"), "mejor a las 4", CONFIG) is None